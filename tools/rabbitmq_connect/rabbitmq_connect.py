@@ -4,11 +4,14 @@ RabbitMQ Connection Script for The ICONIC
 Automates the process of connecting to RabbitMQ on staging/production via AWS SSM port forwarding.
 """
 
-import boto3
 import subprocess
 import sys
 import argparse
 import os
+import json
+import tempfile
+import threading
+import time
 import configparser
 from typing import Optional
 from pathlib import Path
@@ -17,6 +20,19 @@ from pathlib import Path
 # Constants
 INSTANCE_NAME_PATTERN = 'owms'  # EC2 instance naming pattern to search for
 
+# Fast-reconnect cache: skips STS / EC2 lookups on warm reconnects
+CACHE_FILE_NAME = 'rabbitmq_connect.json'
+IDENTITY_CACHE_TTL_SECONDS = 15 * 60       # re-validate the SSO session every 15 minutes
+INSTANCE_CACHE_TTL_SECONDS = 24 * 60 * 60  # the cron instance rarely changes
+# Local ports of a single-environment run; push_order and other clients expect these
+DEFAULT_LOCAL_PORT = 8443
+DEFAULT_AMQP_LOCAL_PORT = 5671
+
+# Owner records of running tunnels, one file per local port, under the cache dir
+TUNNEL_OWNER_DIR_NAME = 'tunnels'
+# Serialises read-modify-write of the cache file between threads (e.g. supervised tunnels)
+_CACHE_LOCK = threading.Lock()
+
 # Environment configurations
 ENV_CONFIGS = {
     'staging': {
@@ -26,6 +42,10 @@ ENV_CONFIGS = {
         'rabbitmq_host': 'b-f99ce4a2-cc49-47d3-a170-f8abd1929417.mq.ap-southeast-2.amazonaws.com',
         'sso_start_url': 'https://zalora-ops.awsapps.com/start#',
         'sso_region': 'ap-southeast-1',
+        # Local ports when several environments are supervised together, so their
+        # tunnels never collide; AMQP skips 5672, which a local RabbitMQ usually uses
+        'multi_env_local_port': 8444,
+        'multi_env_amqp_local_port': 5673,
     },
     'production': {
         'profile': 'TheIconicProductionOMSOperator-057253213810',
@@ -34,19 +54,130 @@ ENV_CONFIGS = {
         'rabbitmq_host': 'b-a798f3c9-b120-4663-97ec-f34258637f4f.mq.ap-southeast-2.amazonaws.com',
         'sso_start_url': 'https://zalora-ops.awsapps.com/start#',
         'sso_region': 'ap-southeast-1',
+        'multi_env_local_port': 8443,
+        'multi_env_amqp_local_port': 5671,
     }
 }
 
 
+def get_cache_dir() -> Path:
+    """Get the oms_tool cache directory (honours XDG_CACHE_HOME)."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+    return Path(cache_home) / 'oms_tool'
+
+
+def write_json_atomic(path: Path, data: dict) -> None:
+    """
+    Write a JSON file atomically with mode 600.
+
+    Each write goes through its own temp file (mkstemp creates it with
+    mode 600), so concurrent writers from other processes never interleave
+    into one file; the last complete write wins.
+
+    Raises:
+        OSError: If the file cannot be written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def is_process_alive(pid: int) -> bool:
+    """Check whether a process with this PID exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def get_tunnel_owner_path(local_port: int) -> Path:
+    """Get the owner file of the tunnel on a local port."""
+    return get_cache_dir() / TUNNEL_OWNER_DIR_NAME / f'{local_port}.json'
+
+
+def read_tunnel_owner(local_port: int) -> Optional[dict]:
+    """
+    Get the owner record of the tunnel listening on a local port.
+
+    The record holds environment, rabbitmq_host, remote_port, kind and the
+    pid of the process serving the port. A record whose process has exited
+    is stale and ignored.
+
+    Returns:
+        The record, or None if the owner is unknown
+    """
+    try:
+        with open(get_tunnel_owner_path(local_port), 'r', encoding='utf-8') as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(owner, dict) or not isinstance(owner.get('pid'), int):
+        return None
+    if not is_process_alive(owner['pid']):
+        return None
+    return owner
+
+
+def find_tunnel_local_port(environment: str, kind: str = 'management') -> int:
+    """
+    Get the local port an environment's tunnel listens on.
+
+    A single-environment tunnel uses 8443/5671; when several environments are
+    supervised together each uses its multi_env_* port. The owner records
+    tell which one is running.
+
+    Args:
+        environment: Environment name
+        kind: 'management' or 'amqp'
+
+    Returns:
+        The port whose owner record is this environment's tunnel, else the default port
+    """
+    config = ENV_CONFIGS[environment]
+    if kind == 'amqp':
+        candidates = [DEFAULT_AMQP_LOCAL_PORT, config['multi_env_amqp_local_port']]
+    else:
+        candidates = [DEFAULT_LOCAL_PORT, config['multi_env_local_port']]
+    for port in candidates:
+        owner = read_tunnel_owner(port)
+        if owner and owner.get('environment') == environment and owner.get('kind') == kind:
+            return port
+    return candidates[0]
+
+
+def describe_tunnel_owner(owner: Optional[dict]) -> str:
+    """Human-readable owner of a local port, for error messages."""
+    if not owner:
+        return 'an unknown process'
+    return f"a {owner.get('environment')} {owner.get('kind')} tunnel (pid {owner.get('pid')})"
+
+
 class RabbitMQConnector:
     """Handles connection to RabbitMQ via AWS SSM."""
 
-    def __init__(self, environment: str = 'production'):
+    def __init__(self, environment: str = 'production', use_cache: bool = True, multi_env: bool = False):
         """
         Initialize the RabbitMQ connector.
 
         Args:
             environment: Environment name (staging or production)
+            use_cache: If False, ignore cached SSO/instance lookups and refresh them
+            multi_env: Listen on the environment's own local ports (multi_env_* in
+                ENV_CONFIGS) instead of 8443/5671, for running next to other environments
         """
         if environment not in ENV_CONFIGS:
             raise ValueError(f"Invalid environment: {environment}. Must be one of: {list(ENV_CONFIGS.keys())}")
@@ -57,9 +188,120 @@ class RabbitMQConnector:
         self.region = self.config['region']
         self.rabbitmq_host = self.config['rabbitmq_host']
         self.remote_port = 443
-        self.local_port = 8443
+        self.local_port = self.config['multi_env_local_port'] if multi_env else DEFAULT_LOCAL_PORT
         self.amqp_remote_port = 5671
-        self.amqp_local_port = 5671
+        self.amqp_local_port = self.config['multi_env_amqp_local_port'] if multi_env else DEFAULT_AMQP_LOCAL_PORT
+        self.use_cache = use_cache
+        self._session = None
+
+    def get_session(self):
+        """
+        Get the boto3 session for this run, creating it on first use.
+
+        boto3 is imported here rather than at module load: importing it takes
+        a noticeable fraction of a second, and a warm reconnect served from the
+        cache never needs it. One session is shared by the STS and EC2 calls.
+        """
+        if self._session is None:
+            import boto3
+            self._session = boto3.Session(profile_name=self.profile, region_name=self.region)
+        return self._session
+
+    def get_cache_path(self) -> Path:
+        """Get the fast-reconnect cache file path (honours XDG_CACHE_HOME)."""
+        return get_cache_dir() / CACHE_FILE_NAME
+
+    def _read_cache(self) -> dict:
+        """Read the whole cache file; a missing or corrupt file is treated as empty."""
+        try:
+            with open(self.get_cache_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def load_cache(self) -> dict:
+        """
+        Get the cached entry for this environment.
+
+        The entry holds:
+        - identity_checked_at: when STS last confirmed the SSO session
+        - instance_id / instance_name / instance_resolved_at: the bastion instance
+        The profile is stored too, so switching profiles invalidates the entry.
+
+        Returns:
+            The entry dict, or {} if caching is disabled or nothing is cached
+        """
+        if not self.use_cache:
+            return {}
+        entry = self._read_cache().get(self.environment) or {}
+        if entry.get('profile') != self.profile:
+            return {}
+        return entry
+
+    def save_cache(self, **values) -> None:
+        """Merge values into this environment's cache entry."""
+        with _CACHE_LOCK:
+            data = self._read_cache()
+            entry = data.get(self.environment) or {}
+            if entry.get('profile') != self.profile:
+                entry = {'profile': self.profile}
+            entry.update(values)
+            data[self.environment] = entry
+            self._write_cache(data)
+
+    def invalidate_cache(self) -> None:
+        """Drop this environment's cache entry so the next run re-validates everything."""
+        with _CACHE_LOCK:
+            data = self._read_cache()
+            if data.pop(self.environment, None) is not None:
+                self._write_cache(data)
+
+    def _write_cache(self, data: dict) -> None:
+        """Write the whole cache file atomically with mode 600."""
+        try:
+            write_json_atomic(self.get_cache_path(), data)
+        except OSError:
+            # The cache is only an optimisation; never fail a connection over it
+            pass
+
+    def owns_tunnel(self, owner: Optional[dict], remote_port: int) -> bool:
+        """Check whether an owner record describes this environment's tunnel to remote_port."""
+        return bool(owner) and (
+            owner.get('environment') == self.environment
+            and owner.get('rabbitmq_host') == self.rabbitmq_host
+            and owner.get('remote_port') == remote_port
+        )
+
+    def record_tunnel_owner(self, local_port: int, remote_port: int, kind: str, pid: int) -> None:
+        """
+        Record that process `pid` serves this environment's tunnel on local_port.
+
+        Other runs read the record before reusing a listening port, so a port
+        held by another environment (or an unknown process) is never mistaken
+        for this environment's tunnel.
+        """
+        try:
+            write_json_atomic(get_tunnel_owner_path(local_port), {
+                'environment': self.environment,
+                'rabbitmq_host': self.rabbitmq_host,
+                'remote_port': remote_port,
+                'kind': kind,
+                'pid': pid,
+            })
+        except OSError as e:
+            print(f"Warning: could not record tunnel owner for localhost:{local_port}: {e}")
+
+    def release_tunnel_owner(self, local_port: int, pid: int) -> None:
+        """Remove the owner record of local_port if it still belongs to `pid`."""
+        path = get_tunnel_owner_path(local_port)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+            if isinstance(owner, dict) and owner.get('pid') == pid:
+                os.remove(path)
+        except (OSError, ValueError):
+            pass
 
     def get_aws_config_path(self) -> Path:
         """Get AWS config file path."""
@@ -143,16 +385,21 @@ class RabbitMQConnector:
 
         Flow: Attempts to call AWS STS GetCallerIdentity to verify credentials
         SSO sessions typically expire after 8 hours and need re-authentication.
+        A successful check is cached for IDENTITY_CACHE_TTL_SECONDS; if the
+        session expires within that window, the SSM failure invalidates the cache.
 
         Returns:
             True if SSO session is valid, False otherwise
         """
+        checked_at = self.load_cache().get('identity_checked_at')
+        if checked_at and time.time() - checked_at < IDENTITY_CACHE_TTL_SECONDS:
+            return True
+
         try:
-            # Create a boto3 session with the configured profile
-            session = boto3.Session(profile_name=self.profile, region_name=self.region)
-            sts_client = session.client('sts')
+            sts_client = self.get_session().client('sts')
             # Test the credentials by calling STS - will fail if session expired
             sts_client.get_caller_identity()
+            self.save_cache(identity_checked_at=time.time())
             return True
         except Exception:
             # Any exception means the session is invalid or expired
@@ -237,14 +484,20 @@ class RabbitMQConnector:
         4. Return the instance ID to be used as SSM bastion
 
         The cron instance is used because it has SSM agent installed and has
-        network access to the RabbitMQ broker.
+        network access to the RabbitMQ broker. The resolved instance is cached
+        for INSTANCE_CACHE_TTL_SECONDS and dropped if the SSM session fails.
 
         Returns:
             Instance ID or None if not found
         """
+        cached = self.load_cache()
+        resolved_at = cached.get('instance_resolved_at')
+        if cached.get('instance_id') and resolved_at and time.time() - resolved_at < INSTANCE_CACHE_TTL_SECONDS:
+            print(f"✓ Found instance: {cached.get('instance_name', 'N/A')} ({cached['instance_id']}) [cached]")
+            return cached['instance_id']
+
         try:
-            session = boto3.Session(profile_name=self.profile, region_name=self.region)
-            ec2_client = session.client('ec2')
+            ec2_client = self.get_session().client('ec2')
 
             # Search for running EC2 instances with 'owms' and 'cron' in the Name tag
             # These instances have SSM agent and network access to RabbitMQ
@@ -278,6 +531,11 @@ class RabbitMQConnector:
 
             instance_id = instances[0][0]
             print(f"✓ Found instance: {instances[0][1]} ({instance_id})")
+            self.save_cache(
+                instance_id=instance_id,
+                instance_name=instances[0][1],
+                instance_resolved_at=time.time(),
+            )
             return instance_id
 
         except Exception as e:
@@ -285,6 +543,27 @@ class RabbitMQConnector:
             print(f"\nMake sure you've logged in with: aws sso login --profile {self.profile}")
             return None
 
+    def build_port_forwarding_command(self, instance_id: str, remote_port: int, local_port: int) -> list:
+        """
+        Build the 'aws ssm start-session' command forwarding local_port to the broker.
+
+        Args:
+            instance_id: EC2 instance ID to use as bastion
+            remote_port: Port on the RabbitMQ broker
+            local_port: Port to listen on locally
+
+        Returns:
+            Command as an argument list
+        """
+        return [
+            'aws', 'ssm', 'start-session',
+            '--target', instance_id,
+            '--document-name', 'AWS-StartPortForwardingSessionToRemoteHost',
+            '--profile', self.profile,
+            '--region', self.region,
+            '--parameters', f'{{"host":["{self.rabbitmq_host}"],"portNumber":["{remote_port}"],"localPortNumber":["{local_port}"]}}'
+        ]
+
     def start_port_forwarding(self, instance_id: str, amqp: bool = False) -> int:
         """
         Start SSM port forwarding session to RabbitMQ.
@@ -293,6 +572,12 @@ class RabbitMQConnector:
         Management UI: [Your Computer:8443] → [SSM] → [EC2 Instance] → [RabbitMQ:443]
         AMQP:          [Your Computer:5671] → [SSM] → [EC2 Instance] → [RabbitMQ:5671]
 
+        The local port's owner is recorded under the cache dir for the
+        duration of the session (see record_tunnel_owner).
+
+        A non-zero exit (expired credentials, terminated instance, ...) clears
+        the fast-reconnect cache so the next run looks everything up again.
+
         Args:
             instance_id: EC2 instance ID to use as bastion
             amqp: If True, tunnel the AMQP port (5671) instead of management UI (443)
@@ -301,22 +586,17 @@ class RabbitMQConnector:
             Exit code from the SSM session
         """
         if amqp:
+            kind = 'amqp'
             remote_port = self.amqp_remote_port
             local_port = self.amqp_local_port
             label = f"AMQP (amqps://localhost:{local_port})"
         else:
+            kind = 'management'
             remote_port = self.remote_port
             local_port = self.local_port
             label = f"Management UI (https://localhost:{local_port})"
 
-        cmd = [
-            'aws', 'ssm', 'start-session',
-            '--target', instance_id,
-            '--document-name', 'AWS-StartPortForwardingSessionToRemoteHost',
-            '--profile', self.profile,
-            '--region', self.region,
-            '--parameters', f'{{"host":["{self.rabbitmq_host}"],"portNumber":["{remote_port}"],"localPortNumber":["{local_port}"]}}'
-        ]
+        cmd = self.build_port_forwarding_command(instance_id, remote_port, local_port)
 
         print(f"\n{'='*60}")
         print(f"Starting port forwarding session to {self.environment.upper()} RabbitMQ...")
@@ -327,22 +607,30 @@ class RabbitMQConnector:
         print(f"{'='*60}\n")
         print("Press Ctrl+C to terminate the session.\n")
 
+        # This process stays alive for the whole session, so it stands in as the port's owner
+        self.record_tunnel_owner(local_port, remote_port, kind, os.getpid())
         try:
             result = subprocess.run(cmd)
-            return result.returncode
         except KeyboardInterrupt:
             print("\n\nSession terminated by user.")
             return 0
         except Exception as e:
             print(f"Error starting port forwarding: {e}")
+            self.invalidate_cache()
             return 1
+        finally:
+            self.release_tunnel_owner(local_port, os.getpid())
 
-    def connect(self, amqp: bool = False):
+        if result.returncode != 0:
+            self.invalidate_cache()
+        return result.returncode
+
+    def prepare(self) -> Optional[str]:
         """
-        Main method to establish connection to RabbitMQ.
+        Run the pre-connection steps: SSO setup/validation and bastion lookup.
 
-        Args:
-            amqp: If True, tunnel AMQP port 5671. If False, tunnel management UI port 443→8443.
+        Returns:
+            EC2 instance ID to forward through, or None if a step failed
         """
         print(f"\n{'='*60}")
         print(f"RabbitMQ Connection - {self.environment.upper()} Environment")
@@ -351,13 +639,25 @@ class RabbitMQConnector:
         # STEP 1: Ensure AWS SSO profile exists and session is valid
         if not self.ensure_sso_setup():
             print("\nCannot proceed without valid AWS SSO session.")
-            sys.exit(1)
+            return None
 
         # STEP 2: Find the EC2 instance to use as bastion
         print("\nFinding EC2 cron instance...")
         instance_id = self.get_ec2_instance_id()
         if not instance_id:
             print("\nFailed to find EC2 instance automatically.")
+            return None
+        return instance_id
+
+    def connect(self, amqp: bool = False):
+        """
+        Main method to establish connection to RabbitMQ.
+
+        Args:
+            amqp: If True, tunnel AMQP port 5671. If False, tunnel management UI port 443→8443.
+        """
+        instance_id = self.prepare()
+        if not instance_id:
             sys.exit(1)
 
         # STEP 3: Start the port forwarding session (blocking call)
@@ -377,6 +677,15 @@ Examples:
   # Connect to staging
   python rabbitmq_connect.py --env staging
 
+  # Supervise management + AMQP tunnels, restarting them if SSM drops
+  python rabbitmq_connect.py --env staging --supervise
+
+  # Supervise both environments (production on 8443/5671, staging on 8444/5673)
+
+  # Supervise only the staging AMQP tunnel
+  python rabbitmq_connect.py --env staging --supervise --amqp
+  python rabbitmq_connect.py --supervise --env production --env staging
+
 Available environments:
   - staging:    TheIconicStagingOMSOperator-101627990447
   - production: TheIconicProductionOMSOperator-057253213810
@@ -386,24 +695,50 @@ Available environments:
     parser.add_argument(
         '--env',
         '--environment',
-        dest='environment',
+        dest='environments',
+        action='append',
         choices=['staging', 'production'],
-        default='production',
-        help='Environment to connect to (default: production)'
+        help='Environment to connect to (default: production); repeatable with --supervise'
     )
 
     parser.add_argument(
         '--amqp',
         action='store_true',
         default=False,
-        help='Tunnel AMQP port 5671 instead of management UI port 443 (needed for push_order.js)'
+        help='Tunnel AMQP port 5671 instead of management UI port 443 (needed for push_order.js); '
+             'with --supervise, start only the AMQP tunnel(s)'
+    )
+
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        default=False,
+        help='Ignore the cached SSO check and instance ID and look them up again'
+    )
+
+    parser.add_argument(
+        '--supervise',
+        action='store_true',
+        default=False,
+        help='Run management and AMQP tunnels (only AMQP with --amqp) as supervised processes with auto-reconnect'
     )
 
     args = parser.parse_args()
+    environments = args.environments or ['production']
+    if len(environments) > 1 and not args.supervise:
+        parser.error('multiple --env values require --supervise')
 
     try:
-        connector = RabbitMQConnector(environment=args.environment)
+        if args.supervise:
+            from tunnel_supervisor import TunnelSupervisor
+            supervisor = TunnelSupervisor.for_environments(environments, management=not args.amqp,
+                                                           use_cache=not args.refresh)
+            sys.exit(supervisor.run_forever())
+        connector = RabbitMQConnector(environment=environments[0], use_cache=not args.refresh)
         sys.exit(connector.connect(amqp=args.amqp))
+    except RuntimeError as e:
+        print(f"\nError: {e}")
+        sys.exit(1)
     except ValueError as e:
         print(f"Error: {e}")
         sys.exit(1)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+RabbitMQ queue monitor over the tunneled management API.
+
+Polls /api/queues on the management port opened by rabbitmq_connect.py for
+the selected environment (https://localhost:8443, or the environment's own
+port when several environments are supervised together) over a single
+keep-alive connection and
+reports, per queue: depth (ready / unacked), consumer count and
+publish / deliver / ack rates. Rates are computed from counter deltas between
+polls, falling back to the broker's own rate on the first poll.
+
+Output is a live terminal table, JSON lines, or Prometheus text format, with
+configurable alert thresholds.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import re
+import ssl
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote, urlsplit
+
+from rabbitmq_connect import RabbitMQConnector, find_tunnel_local_port
+
+
+QUEUE_COLUMNS = [
+    'name', 'vhost', 'messages', 'messages_ready', 'messages_unacknowledged', 'consumers',
+    'message_stats.publish', 'message_stats.publish_details',
+    'message_stats.deliver_get', 'message_stats.deliver_get_details',
+    'message_stats.ack', 'message_stats.ack_details',
+]
+RATE_COUNTERS = {'publish_rate': 'publish', 'deliver_rate': 'deliver_get', 'ack_rate': 'ack'}
+
+
+def check_tunnel_url(url: str, environment: str) -> None:
+    """
+    Make sure a management URL goes through the tunnel that --tunnel opens for this environment.
+
+    Raises:
+        ValueError: If the URL points at another host or port
+    """
+    expected_port = RabbitMQConnector(environment=environment).local_port
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    if parts.hostname not in ('localhost', '127.0.0.1') or port != expected_port:
+        raise ValueError(f"--tunnel opens the {environment} management tunnel on localhost:{expected_port}, "
+                         f"but --url points at {parts.hostname}:{port}")
+
+
+def default_url(environment: str, tunnel: bool = False) -> str:
+    """
+    Management URL of an environment's tunnel, using the same local ports as rabbitmq_connect.py.
+
+    Args:
+        environment: Environment name
+        tunnel: The monitor opens its own (single-environment) tunnel; otherwise
+            the owner records pick the port of an already running tunnel
+
+    Returns:
+        https://localhost:<port>
+    """
+    if tunnel:
+        port = RabbitMQConnector(environment=environment).local_port
+    else:
+        port = find_tunnel_local_port(environment, 'management')
+    return f"https://localhost:{port}"
+
+
+class ManagementClient:
+    """Minimal RabbitMQ management API client reusing one keep-alive connection."""
+
+    def __init__(self, url: str, user: str, password: str, insecure: bool = False, timeout: float = 10.0):
+        """
+        Args:
+            url: Management base URL, e.g. https://localhost:8443
+            user: Management API user
+            password: Management API password
+            insecure: Skip TLS verification (needed through the SSM tunnel)
+            timeout: Socket timeout in seconds
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Invalid management URL: {url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        token = base64.b64encode(f"{user}:{password}".encode('utf-8')).decode('ascii')
+        self.headers = {'Authorization': f"Basic {token}", 'Accept': 'application/json', 'Connection': 'keep-alive'}
+        self.ssl_context = None
+        if self.scheme == 'https':
+            self.ssl_context = ssl.create_default_context()
+            if insecure:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            if self.scheme == 'https':
+                self._conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                                         context=self.ssl_context)
+            else:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_json(self, path: str) -> Any:
+        """
+        GET a management API path and decode the JSON body.
+
+        A dropped keep-alive connection (e.g. the tunnel restarted) is retried
+        once on a fresh connection.
+
+        Returns:
+            Decoded JSON
+        """
+        for attempt in (1, 2):
+            conn = self._connect()
+            try:
+                conn.request('GET', self.base_path + path, headers=self.headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            if response.status == 401:
+                raise PermissionError("Management API rejected the credentials (HTTP 401)")
+            if response.status >= 400:
+                raise RuntimeError(f"Management API returned HTTP {response.status} for {path}")
+            return json.loads(body)
+
+    def get_queues(self) -> List[Dict[str, Any]]:
+        return self.get_json('/api/queues?columns=' + quote(','.join(QUEUE_COLUMNS), safe=','))
+
+
+def compute_metrics(queues: List[Dict[str, Any]], previous: Dict[str, Dict[str, Any]],
+                    elapsed: Optional[float]) -> List[Dict[str, Any]]:
+    """
+    Turn raw /api/queues entries into per-queue metrics.
+
+    Args:
+        queues: Entries from the management API
+        previous: Raw counters from the last poll keyed by 'vhost/name' (updated in place)
+        elapsed: Seconds since the last poll, or None on the first poll
+
+    Returns:
+        One metrics dict per queue, sorted by depth (deepest first)
+    """
+    metrics = []
+    for queue in queues:
+        key = f"{queue.get('vhost', '/')}/{queue['name']}"
+        stats = queue.get('message_stats') or {}
+        counters = {name: stats.get(name) for name in RATE_COUNTERS.values()}
+        last = previous.get(key)
+
+        entry = {
+            'vhost': queue.get('vhost', '/'),
+            'queue': queue['name'],
+            'messages': queue.get('messages') or 0,
+            'messages_ready': queue.get('messages_ready') or 0,
+            'messages_unacknowledged': queue.get('messages_unacknowledged') or 0,
+            'consumers': queue.get('consumers') or 0,
+        }
+        for rate_name, counter in RATE_COUNTERS.items():
+            current = counters[counter]
+            before = last.get(counter) if last else None
+            if elapsed and current is not None and before is not None and current >= before:
+                entry[rate_name] = round((current - before) / elapsed, 2)
+            else:
+                # First poll, counter reset (queue recreated) or stats missing: use the broker's rate
+                entry[rate_name] = float((stats.get(f"{counter}_details") or {}).get('rate') or 0.0)
+        previous[key] = counters
+        metrics.append(entry)
+    metrics.sort(key=lambda m: (-m['messages'], m['queue']))
+    return metrics
+
+
+def check_alerts(entry: Dict[str, Any], max_depth: Optional[int], max_unacked: Optional[int],
+                 min_consumers: Optional[int]) -> List[str]:
+    """
+    Evaluate alert thresholds for one queue.
+
+    Returns:
+        Names of the breached rules (empty if none)
+    """
+    alerts = []
+    if max_depth is not None and entry['messages'] > max_depth:
+        alerts.append('max_depth')
+    if max_unacked is not None and entry['messages_unacknowledged'] > max_unacked:
+        alerts.append('max_unacked')
+    if min_consumers is not None and entry['consumers'] < min_consumers:
+        alerts.append('min_consumers')
+    return alerts
+
+
+def display_name(entry: Dict[str, Any]) -> str:
+    """Queue name, prefixed with its vhost unless it is the default vhost."""
+    return entry['queue'] if entry['vhost'] == '/' else f"{entry['vhost']}/{entry['queue']}"
+
+
+def render_table(metrics: List[Dict[str, Any]], source: str) -> str:
+    header = f"{'QUEUE':<40} {'MSGS':>9} {'READY':>9} {'UNACK':>8} {'CONS':>5} {'PUB/s':>8} {'DLV/s':>8} {'ACK/s':>8}  ALERTS"
+    lines = [f"RabbitMQ queues @ {source} — {time.strftime('%Y-%m-%d %H:%M:%S')}", '', header, '-' * len(header)]
+    for m in metrics:
+        name = display_name(m)
+        lines.append(
+            f"{name[:40]:<40} {m['messages']:>9} {m['messages_ready']:>9} {m['messages_unacknowledged']:>8} "
+            f"{m['consumers']:>5} {m['publish_rate']:>8.1f} {m['deliver_rate']:>8.1f} {m['ack_rate']:>8.1f}  "
+            f"{','.join(m['alerts'])}"
+        )
+    return '\n'.join(lines)
+
+
+def _prom_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(metrics: List[Dict[str, Any]], up: bool = True) -> str:
+    gauges = [
+        ('rabbitmq_queue_messages', 'messages', 'Messages in the queue (ready + unacknowledged)'),
+        ('rabbitmq_queue_messages_ready', 'messages_ready', 'Messages ready for delivery'),
+        ('rabbitmq_queue_messages_unacknowledged', 'messages_unacknowledged', 'Messages delivered but not acked'),
+        ('rabbitmq_queue_consumers', 'consumers', 'Consumers on the queue'),
+        ('rabbitmq_queue_publish_rate', 'publish_rate', 'Messages published per second'),
+        ('rabbitmq_queue_deliver_rate', 'deliver_rate', 'Messages delivered per second'),
+        ('rabbitmq_queue_ack_rate', 'ack_rate', 'Messages acknowledged per second'),
+    ]
+    lines = []
+    for metric, field, help_text in gauges:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for m in metrics:
+            labels = f'vhost="{_prom_label(m["vhost"])}",queue="{_prom_label(m["queue"])}"'
+            lines.append(f"{metric}{{{labels}}} {m[field]}")
+    lines.append("# HELP rabbitmq_queue_alert Alert threshold breached (1) for a queue and rule")
+    lines.append("# TYPE rabbitmq_queue_alert gauge")
+    for m in metrics:
+        for rule in m['alerts']:
+            labels = f'vhost="{_prom_label(m["vhost"])}",queue="{_prom_label(m["queue"])}",rule="{rule}"'
+            lines.append(f"rabbitmq_queue_alert{{{labels}}} 1")
+    lines.append("# HELP rabbitmq_monitor_up Whether the last poll of the management API succeeded")
+    lines.append("# TYPE rabbitmq_monitor_up gauge")
+    lines.append(f"rabbitmq_monitor_up {1 if up else 0}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_output(text: str, path: Optional[str], append: bool) -> None:
+    """Write to stdout, append to a file, or atomically replace a file (Prometheus textfile)."""
+    if not path:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    if append:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(text)
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def report_unreachable(error: Exception, source: str, last_success: Optional[float], args) -> None:
+    """Output a stale/unreachable marker in the selected format and raise an alert for it."""
+    since = f"{time.monotonic() - last_success:.0f}s ago" if last_success else "never"
+    message = f"management API at {source} unreachable: {error} (last successful poll: {since})"
+    if args.format == 'table':
+        clear = '' if args.output else '\033[2J\033[H'
+        text = (f"RabbitMQ queues @ {source} — {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                f"UNREACHABLE: {message}; retrying every {args.interval:g}s\n")
+        write_output(clear + text, args.output, append=False)
+    elif args.format == 'jsonl':
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        record = {'timestamp': timestamp, 'source': source, 'unreachable': True, 'error': str(error),
+                  'alerts': ['unreachable']}
+        write_output(json.dumps(record) + '\n', args.output, append=True)
+    else:
+        write_output(render_prometheus([], up=False), args.output, append=False)
+    print(f"ALERT {message}", file=sys.stderr)
+
+
+def monitor(client: ManagementClient, args) -> int:
+    """
+    Poll until interrupted (or once with --once).
+
+    In the live loop a failed poll (e.g. the tunnel is restarting) is reported
+    as unreachable and polling continues at --interval; with --once it raises.
+
+    Returns:
+        Exit code: 0, or 2 if --once found a breached threshold
+    """
+    queue_filter = re.compile(args.queue) if args.queue else None
+    previous: Dict[str, Dict[str, Any]] = {}
+    last_poll: Optional[float] = None
+    source = f"{client.scheme}://{client.host}:{client.port}"
+
+    while True:
+        polled_at = time.monotonic()
+        try:
+            queues = client.get_queues()
+        except PermissionError:
+            raise
+        except (http.client.HTTPException, OSError) as e:
+            if args.once:
+                raise
+            report_unreachable(e, source, last_poll, args)
+            time.sleep(max(0.0, args.interval - (time.monotonic() - polled_at)))
+            continue
+        if queue_filter:
+            queues = [q for q in queues if queue_filter.search(q['name'])]
+        metrics = compute_metrics(queues, previous, polled_at - last_poll if last_poll else None)
+        last_poll = polled_at
+
+        alerting = []
+        for m in metrics:
+            m['alerts'] = check_alerts(m, args.max_depth, args.max_unacked, args.min_consumers)
+            if m['alerts']:
+                alerting.append(m)
+
+        if args.format == 'table':
+            clear = '' if args.once or args.output else '\033[2J\033[H'
+            write_output(clear + render_table(metrics, source) + '\n', args.output, append=False)
+        elif args.format == 'jsonl':
+            timestamp = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+            text = ''.join(json.dumps({'timestamp': timestamp, **m}) + '\n' for m in metrics)
+            write_output(text, args.output, append=True)
+        else:
+            write_output(render_prometheus(metrics), args.output, append=False)
+
+        for m in alerting:
+            print(f"ALERT {display_name(m)}: {', '.join(m['alerts'])} "
+                  f"(messages={m['messages']}, unacked={m['messages_unacknowledged']}, "
+                  f"consumers={m['consumers']})", file=sys.stderr)
+
+        if args.once:
+            return 2 if alerting else 0
+        time.sleep(max(0.0, args.interval - (time.monotonic() - polled_at)))
+
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(
+        description='Monitor RabbitMQ queue depth and throughput via the tunneled management API',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+Examples:
+  # Live table through an open management tunnel (python rabbitmq_connect.py --env staging)
+  RABBITMQ_MGMT_USER=... RABBITMQ_MGMT_PASSWORD=... python rabbitmq_monitor.py --env staging
+
+  # Open the tunnel for the duration of the run and alert on backlogs
+  python rabbitmq_monitor.py --env staging --tunnel --max-depth 10000 --min-consumers 1
+
+  # Prometheus textfile for node_exporter, refreshed every 15s
+  python rabbitmq_monitor.py --format prometheus --output /var/lib/node_exporter/rabbitmq.prom --interval 15
+
+  # Local stub or container without TLS
+  python rabbitmq_monitor.py --url http://localhost:15672 --once --format jsonl
+        '''
+    )
+    parser.add_argument('--env', '--environment', dest='environment', choices=['staging', 'production'],
+                        default='production', help='Environment whose tunnel to use (default: production)')
+    parser.add_argument('--url', help="Management API base URL (default: the --env tunnel, https://localhost:8443, "
+                                      "or 8444 for staging when supervised next to production)")
+    parser.add_argument('--tunnel', action='store_true', default=False,
+                        help='Open a supervised management tunnel for the duration of the run')
+    parser.add_argument('--user', default=os.environ.get('RABBITMQ_MGMT_USER'),
+                        help='Management API user (default: $RABBITMQ_MGMT_USER)')
+    parser.add_argument('--password', default=os.environ.get('RABBITMQ_MGMT_PASSWORD'),
+                        help='Management API password (default: $RABBITMQ_MGMT_PASSWORD)')
+    parser.add_argument('--insecure', action='store_true', default=None,
+                        help='Skip TLS verification (default: on for localhost, where the tunnel is)')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls (default: 5)')
+    parser.add_argument('--once', action='store_true', default=False,
+                        help='Poll once and exit (exit code 2 if any alert fired)')
+    parser.add_argument('--queue', help='Only include queues whose name matches this regex')
+    parser.add_argument('--format', choices=['table', 'jsonl', 'prometheus'], default='table',
+                        help='Output format (default: table)')
+    parser.add_argument('--output', help='Write to this file instead of stdout (jsonl appends, others replace)')
+    parser.add_argument('--max-depth', type=int, help='Alert when a queue holds more than N messages')
+    parser.add_argument('--max-unacked', type=int, help='Alert when more than N messages are unacknowledged')
+    parser.add_argument('--min-consumers', type=int, help='Alert when a queue has fewer than N consumers')
+
+    args = parser.parse_args()
+    if not args.user or not args.password:
+        parser.error('--user/--password or RABBITMQ_MGMT_USER/RABBITMQ_MGMT_PASSWORD are required')
+    if args.interval <= 0:
+        parser.error('--interval must be > 0')
+
+    try:
+        url = args.url or default_url(args.environment, tunnel=args.tunnel)
+        if args.tunnel:
+            check_tunnel_url(url, args.environment)
+        insecure = args.insecure if args.insecure is not None else urlsplit(url).hostname in ('localhost', '127.0.0.1')
+        client = ManagementClient(url, args.user, args.password, insecure=insecure)
+
+        if args.tunnel:
+            from tunnel_supervisor import TunnelSupervisor
+            with TunnelSupervisor.for_environments([args.environment], amqp=False):
+                sys.exit(monitor(client, args))
+        sys.exit(monitor(client, args))
+    except KeyboardInterrupt:
+        print("\n\nMonitor stopped by user.")
+        sys.exit(0)
+    except re.error as e:
+        print(f"Error: invalid --queue pattern: {e}")
+        sys.exit(1)
+    except (ValueError, PermissionError, RuntimeError, TimeoutError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except (http.client.HTTPException, OSError) as e:
+        print(f"Error: cannot reach the management API: {e}")
+        print("Is the tunnel open? Run: python rabbitmq_connect.py --env <env> (or pass --tunnel)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import socket
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The tools are standalone scripts that import each other by module name
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Keep every test's fast-reconnect cache and tunnel owner files out of the real ~/.cache."""
+    cache_home = tmp_path / "xdg-cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    return cache_home
+
+
+@pytest.fixture
+def fake_aws(tmp_path, monkeypatch):
+    """Put an `aws` executable backed by tests/fake_aws.py first on PATH."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    aws = bin_dir / "aws"
+    aws.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(TESTS_DIR, "fake_aws.py")}" "$@"\n')
+    aws.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return aws
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the aws CLI in tests.
+
+'aws ssm start-session ... --parameters {"localPortNumber": [...]}' listens on
+the local port like a real port-forwarding session. Behaviour is controlled
+through environment variables:
+    FAKE_AWS_DIE: exit with code 255 after this many seconds (default: run until killed)
+    FAKE_AWS_ACCEPT_LOG: append one line per accepted connection to this file
+    FAKE_AWS_NO_LISTEN: if set, never open the port (a session stuck before forwarding)
+Any other command exits with FAKE_AWS_RC (default 0).
+"""
+
+import json
+import os
+import socket
+import sys
+import time
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    if args[:2] != ['ssm', 'start-session']:
+        return int(os.environ.get('FAKE_AWS_RC', '0'))
+    params = json.loads(args[args.index('--parameters') + 1])
+    port = int(params['localPortNumber'][0])
+    die_after = float(os.environ.get('FAKE_AWS_DIE', '0'))
+    accept_log = os.environ.get('FAKE_AWS_ACCEPT_LOG')
+    if os.environ.get('FAKE_AWS_NO_LISTEN'):
+        while True:
+            time.sleep(1)
+
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen()
+    server.settimeout(0.05)
+    started = time.monotonic()
+    while not die_after or time.monotonic() - started < die_after:
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            continue
+        conn.close()
+        if accept_log:
+            with open(accept_log, 'a') as f:
+                f.write('accept\n')
+    return 255
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Minimal stand-in for the RabbitMQ management API (GET /api/queues only), for tests."""
+
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubManagement:
+    """
+    Serves `queues` (a list, or a callable returning one per request) on a free local port.
+
+    Records every request path in `.requests` and every client connection in `.connections`.
+    Use as a context manager; `.url` is the base URL.
+    """
+
+    def __init__(self, queues, user='guest', password='guest'):
+        self.queues = queues
+        self.requests = []
+        self.connections = set()
+        expected = 'Basic ' + base64.b64encode(f"{user}:{password}".encode()).decode()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.connections.add(self.client_address)
+                stub.requests.append(self.path)
+                if self.headers.get('Authorization') != expected:
+                    self.send_response(401)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if not self.path.startswith('/api/queues'):
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                queues = stub.queues() if callable(stub.queues) else stub.queues
+                body = json.dumps(queues).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import pytest
+from aio_pika.exceptions import ChannelInvalidStateError, DeliveryError, PublishError
+from aiormq.abc import DeliveredMessage
+from pamqp.commands import Basic
+from pamqp.header import ContentHeader
+
+import amqp_publisher
+from amqp_publisher import AmqpPublisher, check_tunnel_url, iter_payloads, verify_broker
+
+
+class FakeExchange:
+    """Confirms each publish after `delay`; `outcome(n)` picks the result of the n-th publish."""
+
+    def __init__(self, delay=0.01, outcome=None):
+        self.delay = delay
+        self.outcome = outcome or (lambda n: None)
+        self.published = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def publish(self, message, routing_key, mandatory=True):
+        n = len(self.published)
+        self.published.append(json.loads(message.body))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            error = self.outcome(n)
+            if error is not None:
+                raise error
+            return Basic.Ack(delivery_tag=n + 1)
+        finally:
+            self.in_flight -= 1
+
+
+def publish(exchanges, payloads, window=8):
+    publisher = AmqpPublisher('amqp://localhost', window=window, channels=len(exchanges))
+    publisher._exchanges = list(exchanges)
+    return asyncio.run(publisher.publish(payloads))
+
+
+def returned(n):
+    message = DeliveredMessage(
+        delivery=Basic.Return(reply_code=312, reply_text='NO_ROUTE', exchange='salesorder', routing_key='x'),
+        header=ContentHeader(), body=b'{}', channel=None)
+    return PublishError(message, message.delivery)
+
+
+def test_window_bounds_confirms_in_flight():
+    exchange = FakeExchange()
+    stats = publish([exchange], ({'n': i} for i in range(100)), window=8)
+    assert exchange.max_in_flight == 8
+    assert stats.published == stats.acked == 100 and stats.ok
+    assert len(stats.latencies) == 100
+
+
+def test_publishes_round_robin_over_channels():
+    exchanges = [FakeExchange(), FakeExchange()]
+    stats = publish(exchanges, ({'n': i} for i in range(10)))
+    assert [p['n'] for p in exchanges[0].published] == [0, 2, 4, 6, 8]
+    assert stats.acked == 10
+
+
+def test_nacks_and_returns_are_counted_separately():
+    def outcome(n):
+        if n == 3:
+            return DeliveryError(None, Basic.Nack(delivery_tag=n + 1))
+        if n == 5:
+            return returned(n)
+        return None
+
+    stats = publish([FakeExchange(outcome=outcome)], ({'n': i} for i in range(10)))
+    assert (stats.acked, stats.nacked, stats.returned, stats.failed) == (8, 1, 1, 0)
+    assert stats.error is None and not stats.ok
+    assert '1 nacked, 1 returned' in stats.summary()
+
+
+def test_connection_loss_stops_publishing():
+    lost = ChannelInvalidStateError('connection closed')
+    exchange = FakeExchange(outcome=lambda n: lost if n >= 5 else None)
+    stats = publish([exchange], ({'n': i} for i in range(1000)), window=4)
+    assert stats.error is lost
+    assert stats.acked == 5
+    # Only the publishes already in the window fail; the rest are never attempted
+    assert stats.published < 5 + 2 * 4
+    assert stats.failed == stats.published - 5
+    assert 'Stopped early' in stats.summary()
+
+
+def test_invalid_json_stops_after_pending_confirms(tmp_path):
+    path = tmp_path / 'orders.jsonl'
+    path.write_text('{"n": 0}\n{"n": 1}\nnot json\n{"n": 3}\n')
+    stats = publish([FakeExchange()], iter_payloads(str(path)))
+    assert stats.published == stats.acked == 2
+    assert 'orders.jsonl:3: invalid JSON' in str(stats.error)
+
+
+def test_iter_payloads_checks_path_up_front(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        iter_payloads(str(tmp_path / 'missing.jsonl'))
+    with pytest.raises(ValueError):
+        iter_payloads('-', repeat=2)
+
+
+def test_verify_broker_checks_cluster_name():
+    assert verify_broker({'cluster_name': 'rabbit@stg'}) == 'rabbit@stg'
+    assert verify_broker({}) == 'unknown'
+    assert verify_broker({'cluster_name': b'rabbit@stg'}, 'rabbit@stg') == 'rabbit@stg'
+    with pytest.raises(RuntimeError, match='expected'):
+        verify_broker({'cluster_name': 'rabbit@prd'}, 'rabbit@stg')
+
+
+def test_tunnel_url_must_use_the_environment_port():
+    check_tunnel_url('amqps://u:p@localhost:5671', 'staging')
+    check_tunnel_url('amqps://u:p@localhost', 'production')
+    with pytest.raises(ValueError, match='localhost:5671'):
+        check_tunnel_url('amqps://u:p@localhost:5673', 'staging')
+    with pytest.raises(ValueError):
+        check_tunnel_url('amqps://u:p@broker.example.com:5671', 'staging')
+
+
+def test_unencodable_payload_stops_after_pending_confirms():
+    stats = publish([FakeExchange()], [{'n': 0}, {'n': 1}, {'n': object()}, {'n': 3}])
+    assert stats.published == stats.acked == 2
+    assert 'payload 3 cannot be encoded as JSON' in str(stats.error)
+    assert not stats.ok
+
+
+def test_cli_rejects_non_positive_repeat(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'orders.jsonl'
+    path.write_text('{"n": 0}\n')
+    monkeypatch.setattr('sys.argv', ['amqp_publisher.py', '--url', 'amqp://localhost',
+                                     '--input', str(path), '--repeat', '0'])
+    with pytest.raises(SystemExit) as exit_info:
+        amqp_publisher.main()
+    assert exit_info.value.code == 2
+    assert '--repeat must be >= 1' in capsys.readouterr().err
@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from rabbitmq_connect import IDENTITY_CACHE_TTL_SECONDS, INSTANCE_CACHE_TTL_SECONDS, RabbitMQConnector
+
+
+def test_save_merges_per_environment_and_invalidate_drops_it():
+    staging = RabbitMQConnector("staging")
+    production = RabbitMQConnector("production")
+    staging.save_cache(instance_id="i-stg")
+    production.save_cache(instance_id="i-prd")
+    assert staging.load_cache()["instance_id"] == "i-stg"
+    staging.invalidate_cache()
+    assert staging.load_cache() == {}
+    assert production.load_cache()["instance_id"] == "i-prd"
+
+
+def test_cache_file_is_private_and_no_temp_files_are_left():
+    connector = RabbitMQConnector("staging")
+    connector.save_cache(instance_id="i-stg")
+    path = connector.get_cache_path()
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(path.parent) == [path.name]
+
+
+def test_refresh_ignores_cached_values():
+    RabbitMQConnector("staging").save_cache(instance_id="i-stg")
+    assert RabbitMQConnector("staging", use_cache=False).load_cache() == {}
+
+
+def test_concurrent_writers_keep_the_file_consistent():
+    connectors = [RabbitMQConnector(env) for env in ("staging", "production")]
+    errors = []
+
+    def hammer(connector, n):
+        try:
+            for i in range(50):
+                connector.save_cache(**{f"k{n}_{i}": i})
+                if i % 10 == 0:
+                    connector.invalidate_cache()
+                    connector.save_cache(**{f"k{n}_{i}": i})
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(c, n)) for n, c in enumerate(connectors * 2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    path = connectors[0].get_cache_path()
+    data = json.loads(path.read_text())
+    assert set(data) == {"staging", "production"}
+    assert os.listdir(path.parent) == [path.name]
+
+
+class FakeSession:
+    """Stands in for a boto3 session; counts STS and EC2 calls."""
+
+    def __init__(self, instances=(('i-new', 'owms-stg-cron'),)):
+        self.calls = []
+        self.instances = instances
+
+    def client(self, name):
+        session = self
+
+        class Client:
+            def get_caller_identity(self):
+                session.calls.append('sts')
+                return {'Account': '101627990447'}
+
+            def describe_instances(self, Filters):
+                session.calls.append('ec2')
+                return {'Reservations': [{'Instances': [
+                    {'InstanceId': instance_id, 'Tags': [{'Key': 'Name', 'Value': name}]}
+                    for instance_id, name in session.instances
+                ]}]}
+
+        return Client()
+
+
+def connector_with_session(environment='staging', use_cache=True):
+    connector = RabbitMQConnector(environment, use_cache=use_cache)
+    session = FakeSession()
+    connector.get_session = lambda: session
+    return connector, session
+
+
+def test_sso_check_is_cached_within_ttl_and_repeated_after():
+    connector, session = connector_with_session()
+    assert connector.check_sso_login() and connector.check_sso_login()
+    assert session.calls == ['sts']
+
+    connector.save_cache(identity_checked_at=time.time() - IDENTITY_CACHE_TTL_SECONDS - 1)
+    assert connector.check_sso_login()
+    assert session.calls == ['sts', 'sts']
+
+
+def test_instance_is_cached_within_ttl_and_looked_up_after():
+    connector, session = connector_with_session()
+    assert connector.get_ec2_instance_id() == 'i-new'
+    assert connector.get_ec2_instance_id() == 'i-new'
+    assert session.calls == ['ec2']
+
+    connector.save_cache(instance_id='i-old', instance_resolved_at=time.time() - INSTANCE_CACHE_TTL_SECONDS - 1)
+    assert connector.get_ec2_instance_id() == 'i-new'
+    assert session.calls == ['ec2', 'ec2']
+
+
+def test_refresh_bypasses_cached_sso_check_and_instance():
+    RabbitMQConnector('staging').save_cache(
+        identity_checked_at=time.time(), instance_id='i-old', instance_resolved_at=time.time())
+    connector, session = connector_with_session(use_cache=False)
+    assert connector.check_sso_login()
+    assert connector.get_ec2_instance_id() == 'i-new'
+    assert session.calls == ['sts', 'ec2']
+
+
+def test_warm_prepare_never_imports_boto3(tmp_path, monkeypatch):
+    home = tmp_path / 'home'
+    (home / '.aws').mkdir(parents=True)
+    connector = RabbitMQConnector('staging')
+    (home / '.aws' / 'config').write_text(f'[profile {connector.profile}]\nregion = ap-southeast-2\n')
+    monkeypatch.setenv('HOME', str(home))
+    connector.save_cache(identity_checked_at=time.time(), instance_id='i-warm', instance_resolved_at=time.time())
+
+    # Any import of boto3 now fails, so a warm prepare() must not need it
+    monkeypatch.setitem(sys.modules, 'boto3', None)
+    assert connector.prepare() == 'i-warm'
+    assert connector._session is None
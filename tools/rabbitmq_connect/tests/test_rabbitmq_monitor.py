@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from rabbitmq_connect import RabbitMQConnector
+
+import rabbitmq_monitor
+from rabbitmq_monitor import (
+    ManagementClient,
+    check_alerts,
+    check_tunnel_url,
+    compute_metrics,
+    default_url,
+    monitor,
+    render_prometheus,
+)
+
+from .stub_management import StubManagement
+
+
+def queue(name, messages=0, unacked=0, consumers=1, publish=None, publish_rate=0.0, vhost='/'):
+    entry = {'name': name, 'vhost': vhost, 'messages': messages, 'messages_ready': messages - unacked,
+             'messages_unacknowledged': unacked, 'consumers': consumers}
+    if publish is not None:
+        entry['message_stats'] = {'publish': publish, 'publish_details': {'rate': publish_rate}}
+    return entry
+
+
+def monitor_args(**overrides):
+    values = dict(queue=None, max_depth=None, max_unacked=None, min_consumers=None, format='jsonl',
+                  output=None, once=True, interval=1.0)
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def test_default_url_follows_environment_ports():
+    assert default_url('production') == 'https://localhost:8443'
+    assert default_url('staging') == 'https://localhost:8443'
+    # staging supervised next to production
+    RabbitMQConnector('staging', multi_env=True).record_tunnel_owner(8444, 443, 'management', os.getpid())
+    assert default_url('staging') == 'https://localhost:8444'
+    assert default_url('staging', tunnel=True) == 'https://localhost:8443'
+
+
+def test_first_poll_uses_broker_rate_then_counter_deltas():
+    previous = {}
+    [first] = compute_metrics([queue('orders', publish=100, publish_rate=7.5)], previous, None)
+    assert first['publish_rate'] == 7.5
+    assert first['deliver_rate'] == 0.0
+    [second] = compute_metrics([queue('orders', publish=150, publish_rate=7.5)], previous, 10.0)
+    assert second['publish_rate'] == 5.0
+
+
+def test_counter_reset_falls_back_to_broker_rate():
+    previous = {}
+    compute_metrics([queue('orders', publish=1000)], previous, None)
+    [entry] = compute_metrics([queue('orders', publish=10, publish_rate=2.0)], previous, 5.0)
+    assert entry['publish_rate'] == 2.0
+
+
+def test_metrics_are_sorted_deepest_first_and_keyed_by_vhost():
+    previous = {}
+    metrics = compute_metrics([queue('a', messages=1), queue('b', messages=9), queue('a', messages=5, vhost='oms')],
+                              previous, None)
+    assert [(m['vhost'], m['queue']) for m in metrics] == [('/', 'b'), ('oms', 'a'), ('/', 'a')]
+    assert set(previous) == {'//a', '//b', 'oms/a'}
+
+
+def test_check_alerts():
+    [entry] = compute_metrics([queue('orders', messages=50, unacked=20, consumers=0)], {}, None)
+    assert check_alerts(entry, 10, 30, 1) == ['max_depth', 'min_consumers']
+    assert check_alerts(entry, None, None, None) == []
+
+
+def test_render_prometheus_escapes_labels_and_lists_alerts():
+    [entry] = compute_metrics([queue('odd "q"\\', messages=3, consumers=0)], {}, None)
+    entry['alerts'] = ['min_consumers']
+    text = render_prometheus([entry])
+    assert 'rabbitmq_queue_messages{vhost="/",queue="odd \\"q\\"\\\\"} 3' in text
+    assert '# TYPE rabbitmq_queue_consumers gauge' in text
+    assert 'rabbitmq_queue_alert{vhost="/",queue="odd \\"q\\"\\\\",rule="min_consumers"} 1' in text
+    assert text.endswith('\n')
+
+
+def test_client_reuses_one_connection_and_requests_only_needed_columns():
+    with StubManagement([queue('orders', messages=4)]) as stub:
+        client = ManagementClient(stub.url, 'guest', 'guest')
+        for _ in range(3):
+            assert client.get_queues()[0]['name'] == 'orders'
+        client.close()
+    assert len(stub.connections) == 1
+    assert all(path.startswith('/api/queues?columns=name,vhost,') for path in stub.requests)
+
+
+def test_client_rejects_bad_credentials():
+    with StubManagement([]) as stub:
+        with pytest.raises(PermissionError):
+            ManagementClient(stub.url, 'guest', 'wrong').get_queues()
+
+
+def test_client_reconnects_after_dropped_connection():
+    with StubManagement([queue('orders')]) as stub:
+        client = ManagementClient(stub.url, 'guest', 'guest')
+        client.get_queues()
+        client._conn.sock.close()  # simulate the tunnel dropping the keep-alive connection
+        assert client.get_queues()[0]['name'] == 'orders'
+    assert len(stub.connections) == 2
+
+
+def test_monitor_once_reports_alerts_with_exit_code(capsys):
+    queues = [queue('orders', messages=500, consumers=0), queue('other', messages=1)]
+    with StubManagement(queues) as stub:
+        client = ManagementClient(stub.url, 'guest', 'guest')
+        rc = monitor(client, monitor_args(queue='^ord', max_depth=100))
+    captured = capsys.readouterr()
+    assert rc == 2
+    assert '"queue": "orders"' in captured.out and 'other' not in captured.out
+    assert 'ALERT orders: max_depth' in captured.err
+
+
+def test_monitor_once_without_alerts_writes_prometheus_file(tmp_path):
+    output = tmp_path / 'rabbitmq.prom'
+    with StubManagement([queue('orders', messages=5)]) as stub:
+        client = ManagementClient(stub.url, 'guest', 'guest')
+        rc = monitor(client, monitor_args(format='prometheus', output=str(output), max_depth=100))
+    assert rc == 0
+    assert 'rabbitmq_queue_messages{vhost="/",queue="orders"} 5' in output.read_text()
+
+
+class FlakyClient:
+    """ManagementClient stand-in whose polls follow a script of results or exceptions."""
+
+    scheme, host, port = 'https', 'localhost', 8443
+
+    def __init__(self, script):
+        self.script = list(script)
+
+    def get_queues(self):
+        result = self.script.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class StopMonitor(Exception):
+    pass
+
+
+def run_live(client, monkeypatch, polls, **overrides):
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) >= polls:
+            raise StopMonitor()
+
+    monkeypatch.setattr(rabbitmq_monitor.time, 'sleep', fake_sleep)
+    with pytest.raises(StopMonitor):
+        monitor(client, monitor_args(once=False, **overrides))
+    return sleeps
+
+
+def test_live_monitor_survives_unreachable_api(monkeypatch, capsys):
+    client = FlakyClient([ConnectionRefusedError('tunnel down'), [queue('orders', messages=3)]])
+    sleeps = run_live(client, monkeypatch, polls=2)
+    captured = capsys.readouterr()
+    lines = [json.loads(line) for line in captured.out.splitlines()]
+    assert lines[0]['unreachable'] and 'tunnel down' in lines[0]['error']
+    assert lines[1]['queue'] == 'orders'
+    assert 'ALERT management API at https://localhost:8443 unreachable' in captured.err
+    assert len(sleeps) == 2
+
+
+def test_live_monitor_marks_prometheus_output_down(monkeypatch, tmp_path):
+    output = tmp_path / 'rabbitmq.prom'
+    client = FlakyClient([[queue('orders', messages=3)], ConnectionResetError('dropped')])
+    run_live(client, monkeypatch, polls=2, format='prometheus', output=str(output))
+    text = output.read_text()
+    assert 'rabbitmq_monitor_up 0' in text
+    assert 'rabbitmq_queue_messages{' not in text
+
+
+def test_once_still_fails_on_unreachable_api():
+    client = FlakyClient([ConnectionRefusedError('tunnel down')])
+    with pytest.raises(ConnectionRefusedError):
+        monitor(client, monitor_args())
+
+
+def test_bad_credentials_are_not_retried(monkeypatch):
+    client = FlakyClient([PermissionError('HTTP 401')])
+    with pytest.raises(PermissionError):
+        run_live(client, monkeypatch, polls=5)
+
+
+def test_tunnel_requires_matching_url():
+    check_tunnel_url('https://localhost:8443', 'staging')
+    with pytest.raises(ValueError, match='localhost:8443'):
+        check_tunnel_url('https://localhost:8444', 'staging')
+    with pytest.raises(ValueError):
+        check_tunnel_url('https://broker.example.com', 'production')
@@ -0,0 +1,202 @@
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+
+import rabbitmq_connect
+import tunnel_supervisor
+from rabbitmq_connect import RabbitMQConnector, find_tunnel_local_port, get_tunnel_owner_path, read_tunnel_owner
+from tunnel_supervisor import Tunnel, TunnelSupervisor
+
+from .conftest import free_port
+
+
+def make_supervisor(*tunnels, **kwargs):
+    options = dict(backoff_base_seconds=0.05, backoff_max_seconds=0.1, probe_interval_seconds=0.05,
+                   health_check_interval_seconds=0.05, ready_timeout_seconds=10, log=lambda message: None)
+    options.update(kwargs)
+    return TunnelSupervisor(list(tunnels), **options)
+
+
+def amqp_tunnel(environment, port):
+    return Tunnel(RabbitMQConnector(environment), 'i-1', 'amqp', port, 5671)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_single_environment_keeps_default_ports(monkeypatch):
+    monkeypatch.setattr(RabbitMQConnector, 'prepare', lambda self: 'i-1')
+    for environment in ('staging', 'production'):
+        supervisor = TunnelSupervisor.for_environments([environment])
+        assert sorted(t.local_port for t in supervisor.tunnels) == [5671, 8443]
+        assert RabbitMQConnector(environment).amqp_local_port == 5671
+
+
+def test_supervise_with_amqp_starts_only_amqp_tunnels(monkeypatch):
+    calls = []
+
+    class FakeSupervisor:
+        @classmethod
+        def for_environments(cls, environments, **kwargs):
+            calls.append((environments, kwargs))
+            return cls()
+
+        def run_forever(self):
+            return 0
+
+    monkeypatch.setattr(tunnel_supervisor, 'TunnelSupervisor', FakeSupervisor)
+    monkeypatch.setattr('sys.argv', ['rabbitmq_connect.py', '--env', 'staging', '--supervise', '--amqp'])
+    with pytest.raises(SystemExit) as exit_info:
+        rabbitmq_connect.main()
+    assert exit_info.value.code == 0
+    assert calls == [(['staging'], {'management': False, 'use_cache': True})]
+
+
+def test_environments_have_fixed_distinct_ports(monkeypatch):
+    monkeypatch.setattr(RabbitMQConnector, 'prepare', lambda self: 'i-1')
+    both = TunnelSupervisor.for_environments(['staging', 'production'])
+    reversed_order = TunnelSupervisor.for_environments(['production', 'staging'])
+    ports = {(t.connector.environment, t.kind): t.local_port for t in both.tunnels}
+    assert ports == {
+        ('staging', 'management'): 8444, ('staging', 'amqp'): 5673,
+        ('production', 'management'): 8443, ('production', 'amqp'): 5671,
+    }
+    assert ports == {(t.connector.environment, t.kind): t.local_port for t in reversed_order.tunnels}
+    assert 5672 not in ports.values()
+
+
+def test_spawned_tunnel_records_and_releases_owner(fake_aws):
+    port = free_port()
+    tunnel = amqp_tunnel('staging', port)
+    with make_supervisor(tunnel):
+        assert tunnel.state == 'ready'
+        owner = read_tunnel_owner(port)
+        assert owner['environment'] == 'staging' and owner['kind'] == 'amqp'
+        assert owner['pid'] == tunnel.process.pid
+        process = tunnel.process
+    assert process.poll() is not None
+    assert not get_tunnel_owner_path(port).exists()
+
+
+def test_dropped_session_is_restarted_with_fresh_instance(fake_aws, monkeypatch):
+    monkeypatch.setenv('FAKE_AWS_DIE', '0.3')
+    port = free_port()
+    tunnel = amqp_tunnel('staging', port)
+    lookups = []
+    tunnel.connector.get_ec2_instance_id = lambda: lookups.append(1) or 'i-2'
+    # The exit is noticed through poll(), not by probing the port
+    with make_supervisor(tunnel, health_check_interval_seconds=60):
+        assert wait_for(lambda: tunnel.instance_id == 'i-2' and tunnel.state == 'ready')
+    assert lookups and tunnel.restarts >= 1
+
+
+def test_same_environment_tunnel_is_reused(fake_aws):
+    port = free_port()
+    first = amqp_tunnel('staging', port)
+    second = amqp_tunnel('staging', port)
+    with make_supervisor(first):
+        with make_supervisor(second):
+            assert second.state == 'external' and second.process is None
+        assert first.process.poll() is None
+
+
+def test_other_environment_tunnel_is_not_reused(fake_aws):
+    port = free_port()
+    with make_supervisor(amqp_tunnel('production', port)):
+        with pytest.raises(RuntimeError, match='production amqp tunnel'):
+            with make_supervisor(amqp_tunnel('staging', port)):
+                pass
+
+
+def test_unknown_listener_is_not_reused(fake_aws):
+    port = free_port()
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', port))
+        listener.listen()
+        with pytest.raises(RuntimeError, match='unknown process'):
+            with make_supervisor(amqp_tunnel('staging', port)):
+                pass
+
+
+def test_stale_owner_record_is_treated_as_unknown(fake_aws):
+    port = free_port()
+    connector = RabbitMQConnector('staging')
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', port))
+        listener.listen()
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        connector.record_tunnel_owner(port, 5671, 'amqp', dead.pid)
+        assert read_tunnel_owner(port) is None
+        with pytest.raises(RuntimeError, match='unknown process'):
+            with make_supervisor(Tunnel(connector, 'i-1', 'amqp', port, 5671)):
+                pass
+
+
+def test_ready_tunnel_is_probed_only_at_health_check_interval(fake_aws, monkeypatch, tmp_path):
+    accept_log = tmp_path / 'accepts.log'
+    monkeypatch.setenv('FAKE_AWS_ACCEPT_LOG', str(accept_log))
+    tunnel = amqp_tunnel('staging', free_port())
+    with make_supervisor(tunnel, health_check_interval_seconds=60):
+        time.sleep(0.5)
+        assert tunnel.state == 'ready'
+    assert accept_log.read_text().count('accept') == 1
+
+
+def test_session_that_never_listens_is_restarted(fake_aws, monkeypatch):
+    monkeypatch.setenv('FAKE_AWS_NO_LISTEN', '1')
+    tunnel = amqp_tunnel('staging', free_port())
+    supervisor = make_supervisor(tunnel, start_timeout_seconds=0.3)
+    supervisor.start()
+    try:
+        assert wait_for(lambda: tunnel.process is not None)
+        first = tunnel.process
+        assert wait_for(lambda: tunnel.restarts >= 1 and tunnel.process is not None and tunnel.process is not first)
+        assert first.wait(timeout=5) is not None
+        assert not supervisor.wait_ready(timeout=0.2)
+    finally:
+        supervisor.stop()
+
+
+def test_find_tunnel_local_port_follows_owner_records():
+    assert find_tunnel_local_port('staging') == 8443
+    staging = RabbitMQConnector('staging', multi_env=True)
+    staging.record_tunnel_owner(8444, 443, 'management', os.getpid())
+    assert find_tunnel_local_port('staging') == 8444
+    assert find_tunnel_local_port('staging', 'amqp') == 5671
+    RabbitMQConnector('staging').record_tunnel_owner(8443, 443, 'management', os.getpid())
+    assert find_tunnel_local_port('staging') == 8443
+
+
+def test_plain_session_records_owner_while_running(fake_aws, monkeypatch):
+    monkeypatch.setenv('FAKE_AWS_DIE', '1')
+    connector = RabbitMQConnector('staging')
+    connector.amqp_local_port = free_port()
+    connector.save_cache(instance_id='i-1')
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(rc=connector.start_port_forwarding('i-1', amqp=True)))
+    thread.start()
+    assert wait_for(lambda: read_tunnel_owner(connector.amqp_local_port) is not None)
+    assert connector.owns_tunnel(read_tunnel_owner(connector.amqp_local_port), 5671)
+    thread.join()
+    assert result['rc'] == 255
+    assert not get_tunnel_owner_path(connector.amqp_local_port).exists()
+    # A failed session clears the fast-reconnect cache
+    assert connector.load_cache() == {}
+
+
+def test_owner_of_other_process_is_not_released():
+    connector = RabbitMQConnector('staging')
+    connector.record_tunnel_owner(5673, 5671, 'amqp', os.getpid())
+    connector.release_tunnel_owner(5673, -1)
+    assert read_tunnel_owner(5673) is not None
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Supervised SSM tunnels for RabbitMQ.
+
+Runs several 'aws ssm start-session' port forwards (management UI and AMQP,
+for one or more environments) as managed child processes. Every environment
+has its own fixed local ports (see ENV_CONFIGS), and each running tunnel
+records its owner under the cache dir. Each tunnel is watched by its own
+thread which:
+- reuses a tunnel that is already listening on the local port instead of
+  spawning a duplicate, but only if its owner record says it is the same
+  environment's tunnel; a port held by anything else is reported, not used
+- probes the local port until it accepts TCP connections, then watches the
+  child process and re-probes only every health_check_interval_seconds
+- restarts a dropped session with exponential backoff, re-resolving the
+  bastion instance in case it was replaced
+
+Usage as a context manager (returns once every port accepts connections):
+
+    with TunnelSupervisor.for_environments(['staging'], management=False) as supervisor:
+        ...  # amqps://localhost:5671 is ready
+"""
+
+import random
+import socket
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+from rabbitmq_connect import RabbitMQConnector, describe_tunnel_owner, read_tunnel_owner
+
+
+def is_port_open(port: int, host: str = '127.0.0.1', timeout: float = 0.5) -> bool:
+    """
+    Check whether something accepts TCP connections on host:port.
+
+    Returns:
+        True if a connection could be established, False otherwise
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class Tunnel:
+    """One supervised port forward from a local port to the broker."""
+
+    def __init__(self, connector: RabbitMQConnector, instance_id: str, kind: str,
+                 local_port: int, remote_port: int):
+        """
+        Args:
+            connector: Connector for the tunnel's environment
+            instance_id: EC2 instance ID to use as bastion
+            kind: 'management' or 'amqp' (used for labels only)
+            local_port: Port to listen on locally
+            remote_port: Port on the RabbitMQ broker
+        """
+        self.connector = connector
+        self.instance_id = instance_id
+        self.kind = kind
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.process: Optional[subprocess.Popen] = None
+        self.state = 'pending'  # pending | starting | ready | external | conflict | restarting | stopped
+        self.conflict: Optional[str] = None  # who holds the port while state is 'conflict'
+        self.last_probe = 0.0
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+
+    @property
+    def label(self) -> str:
+        return f"{self.connector.environment}/{self.kind} localhost:{self.local_port}"
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state in ('ready', 'external')
+
+
+class TunnelSupervisor:
+    """Starts, probes and restarts a set of tunnels until stopped."""
+
+    def __init__(self, tunnels: List[Tunnel], backoff_base_seconds: float = 1.0,
+                 backoff_max_seconds: float = 60.0, probe_interval_seconds: float = 1.0,
+                 health_check_interval_seconds: float = 30.0, start_timeout_seconds: float = 30.0,
+                 ready_timeout_seconds: float = 60.0, log: Callable[[str], None] = print):
+        """
+        Args:
+            tunnels: Tunnels to supervise (local ports must be distinct)
+            backoff_base_seconds: First restart delay; doubles per consecutive failure
+            backoff_max_seconds: Upper bound for the restart delay
+            probe_interval_seconds: How often child processes are polled, and a
+                starting tunnel's port is probed
+            health_check_interval_seconds: How often the port of a ready or reused
+                tunnel is probed again (each probe is a connection the broker logs)
+            start_timeout_seconds: How long a started session may take to open its
+                port before it is killed and restarted
+            ready_timeout_seconds: How long the context manager waits for readiness
+            log: Callback for status messages
+        """
+        ports = [t.local_port for t in tunnels]
+        if len(set(ports)) != len(ports):
+            raise ValueError(f"Tunnel local ports must be distinct, got: {ports}")
+        self.tunnels = tunnels
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.probe_interval_seconds = probe_interval_seconds
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.start_timeout_seconds = start_timeout_seconds
+        self.ready_timeout_seconds = ready_timeout_seconds
+        self._log = log
+        self._log_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # boto3 sessions are not thread-safe, so instance lookups are serialised
+        self._lookup_lock = threading.Lock()
+
+    @classmethod
+    def for_environments(cls, environments: List[str], management: bool = True, amqp: bool = True,
+                         use_cache: bool = True, **kwargs) -> 'TunnelSupervisor':
+        """
+        Prepare tunnels for each environment.
+
+        A single environment listens on the usual 8443/5671. With several
+        environments, each uses its own fixed ports from ENV_CONFIGS
+        (production 8443/5671, staging 8444/5673), independent of their order.
+        SSO setup runs up front, one environment at a time, as it may prompt.
+
+        Args:
+            environments: Environment names
+            management: Include the management UI tunnel (443 → local_port)
+            amqp: Include the AMQP tunnel (5671 → amqp_local_port)
+            use_cache: Use the fast-reconnect cache for SSO/instance lookups
+            **kwargs: Passed to TunnelSupervisor
+
+        Returns:
+            A supervisor that has not been started yet
+        """
+        if not (management or amqp):
+            raise ValueError("At least one of management or amqp tunnels is required")
+        tunnels = []
+        multi_env = len(set(environments)) > 1
+        for environment in environments:
+            connector = RabbitMQConnector(environment=environment, use_cache=use_cache, multi_env=multi_env)
+            instance_id = connector.prepare()
+            if not instance_id:
+                raise RuntimeError(f"Cannot prepare {environment} tunnels (SSO or instance lookup failed)")
+            if management:
+                tunnels.append(Tunnel(connector, instance_id, 'management',
+                                      connector.local_port, connector.remote_port))
+            if amqp:
+                tunnels.append(Tunnel(connector, instance_id, 'amqp',
+                                      connector.amqp_local_port, connector.amqp_remote_port))
+        return cls(tunnels, **kwargs)
+
+    def log(self, message: str) -> None:
+        # Supervising threads log concurrently; keep their lines from interleaving
+        with self._log_lock:
+            self._log(message)
+
+    def start(self) -> None:
+        """Start one supervising thread per tunnel."""
+        self._stop.clear()
+        for tunnel in self.tunnels:
+            thread = threading.Thread(target=self._supervise, args=(tunnel,),
+                                      name=f"tunnel-{tunnel.local_port}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every tunnel accepts connections.
+
+        Returns early if a tunnel's port is held by something else, as waiting
+        will not fix that.
+
+        Returns:
+            True if all tunnels became ready within the timeout, False otherwise
+        """
+        deadline = time.monotonic() + (self.ready_timeout_seconds if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            if all(t.is_ready for t in self.tunnels):
+                return True
+            if any(t.state == 'conflict' for t in self.tunnels):
+                return False
+            if self._stop.wait(0.1):
+                return False
+        return all(t.is_ready for t in self.tunnels)
+
+    def stop(self) -> None:
+        """Stop supervising and terminate the tunnels this supervisor spawned."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        for tunnel in self.tunnels:
+            self._terminate(tunnel)
+            tunnel.state = 'stopped'
+
+    def run_forever(self) -> int:
+        """
+        Supervise until Ctrl+C.
+
+        Returns:
+            Exit code (0 on user interrupt)
+        """
+        self.start()
+        try:
+            if self.wait_ready():
+                self.log("✓ All tunnels ready:")
+            else:
+                self.log("Some tunnels are not ready yet; still retrying:")
+            for tunnel in self.tunnels:
+                detail = f" (port in use by {tunnel.conflict})" if tunnel.state == 'conflict' else ''
+                self.log(f"  {tunnel.label} [{tunnel.state}]{detail}")
+            self.log("\nPress Ctrl+C to terminate all sessions.\n")
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.log("\n\nSessions terminated by user.")
+        finally:
+            self.stop()
+        return 0
+
+    def __enter__(self) -> 'TunnelSupervisor':
+        self.start()
+        if not self.wait_ready():
+            conflicts = [f"localhost:{t.local_port} is in use by {t.conflict}"
+                         for t in self.tunnels if t.state == 'conflict']
+            pending = [t.label for t in self.tunnels if not t.is_ready]
+            self.stop()
+            if conflicts:
+                raise RuntimeError(f"Cannot start tunnels: {'; '.join(conflicts)}")
+            raise TimeoutError(f"Tunnels not ready after {self.ready_timeout_seconds:.0f}s: {', '.join(pending)}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    def _backoff(self, failures: int) -> float:
+        ceiling = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** max(0, failures - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _spawn(self, tunnel: Tunnel) -> None:
+        cmd = tunnel.connector.build_port_forwarding_command(
+            tunnel.instance_id, tunnel.remote_port, tunnel.local_port)
+        # Own session so a terminal Ctrl+C reaches the supervisor, which then shuts children down
+        tunnel.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                          start_new_session=True)
+        tunnel.connector.record_tunnel_owner(tunnel.local_port, tunnel.remote_port, tunnel.kind,
+                                             tunnel.process.pid)
+        tunnel.state = 'starting'
+        tunnel.started_at = time.monotonic()
+        self.log(f"Started {tunnel.label} (pid {tunnel.process.pid})")
+
+    def _terminate(self, tunnel: Tunnel) -> None:
+        process = tunnel.process
+        tunnel.process = None
+        if process is None:
+            return
+        tunnel.connector.release_tunnel_owner(tunnel.local_port, process.pid)
+        if process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _handle_exit(self, tunnel: Tunnel, returncode: int) -> None:
+        tunnel.connector.release_tunnel_owner(tunnel.local_port, tunnel.process.pid)
+        tunnel.process = None
+        tunnel.failures += 1
+        tunnel.restarts += 1
+        tunnel.state = 'restarting'
+        delay = self._backoff(tunnel.failures)
+        self.log(f"✗ {tunnel.label} exited with code {returncode}; restarting in {delay:.1f}s")
+        if returncode != 0:
+            # The bastion may have been replaced or credentials expired: look it up again
+            with self._lookup_lock:
+                tunnel.connector.invalidate_cache()
+                instance_id = tunnel.connector.get_ec2_instance_id()
+            if instance_id:
+                tunnel.instance_id = instance_id
+        self._stop.wait(delay)
+
+    def _restart(self, tunnel: Tunnel, reason: str) -> None:
+        """Kill a session whose process is still running and restart it after a backoff."""
+        tunnel.failures += 1
+        tunnel.restarts += 1
+        delay = self._backoff(tunnel.failures)
+        self.log(f"✗ {tunnel.label} {reason}; restarting in {delay:.1f}s")
+        self._terminate(tunnel)
+        tunnel.state = 'restarting'
+        self._stop.wait(delay)
+
+    def _check_existing(self, tunnel: Tunnel) -> None:
+        """Adopt the listener on the tunnel's port if it is this environment's tunnel, else flag a conflict."""
+        owner = read_tunnel_owner(tunnel.local_port)
+        if tunnel.connector.owns_tunnel(owner, tunnel.remote_port):
+            # Another session (e.g. a separate rabbitmq_connect.py run) already serves this port
+            if tunnel.state != 'external':
+                self.log(f"✓ Reusing existing tunnel on {tunnel.label} (pid {owner['pid']})")
+            tunnel.state = 'external'
+            tunnel.conflict = None
+        else:
+            conflict = describe_tunnel_owner(owner)
+            if tunnel.state != 'conflict' or tunnel.conflict != conflict:
+                self.log(f"✗ localhost:{tunnel.local_port} is in use by {conflict}; "
+                         f"not using it for {tunnel.label}")
+            tunnel.state = 'conflict'
+            tunnel.conflict = conflict
+
+    def _supervise(self, tunnel: Tunnel) -> None:
+        while not self._stop.is_set():
+            if tunnel.process is None:
+                if is_port_open(tunnel.local_port):
+                    self._check_existing(tunnel)
+                    self._stop.wait(self.health_check_interval_seconds)
+                    continue
+                if tunnel.state in ('external', 'conflict'):
+                    self.log(f"Port of {tunnel.label} was released; taking over")
+                    tunnel.conflict = None
+                try:
+                    self._spawn(tunnel)
+                except OSError as e:
+                    self.log(f"Error starting {tunnel.label}: {e}")
+                    tunnel.failures += 1
+                    tunnel.state = 'restarting'
+                    self._stop.wait(self._backoff(tunnel.failures))
+                    continue
+            else:
+                returncode = tunnel.process.poll()
+                if returncode is not None:
+                    self._handle_exit(tunnel, returncode)
+                    continue
+                # Probe until the tunnel is ready; after that a dead session normally shows up
+                # through poll(), so the port is only re-checked occasionally
+                now = time.monotonic()
+                if tunnel.state != 'ready' or now - tunnel.last_probe >= self.health_check_interval_seconds:
+                    tunnel.last_probe = now
+                    if is_port_open(tunnel.local_port):
+                        if tunnel.state != 'ready':
+                            self.log(f"✓ {tunnel.label} is accepting connections")
+                        tunnel.state = 'ready'
+                        tunnel.failures = 0
+                    elif tunnel.state == 'ready':
+                        # Process alive but port closed: SSM lost the session without exiting
+                        self._restart(tunnel, "stopped accepting connections")
+                        continue
+                    elif now - tunnel.started_at >= self.start_timeout_seconds:
+                        # Session hangs without ever listening (e.g. stuck on the SSM handshake)
+                        self._restart(tunnel, f"did not open its port within {self.start_timeout_seconds:.0f}s")
+                        continue
+            self._stop.wait(self.probe_interval_seconds)
+        self._terminate(tunnel)
@@ -0,0 +1,45 @@
+import os
+import re
+from typing import Any, Dict
+
+import yaml
+
+
+_ENV_PATTERN = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_]*)(?::-([^}]*))?\}")
+
+
+def expand_env(value: Any) -> Any:
+    """Expand ${VAR} and ${VAR:-default} placeholders in strings, recursively."""
+    if isinstance(value, str):
+        def repl(match: "re.Match[str]") -> str:
+            name, default = match.group(1), match.group(2)
+            resolved = os.environ.get(name)
+            if not resolved:
+                # Unset variables expand to "" so required keys are reported by name below
+                return default if default is not None else ""
+            return resolved
+
+        return _ENV_PATTERN.sub(repl, value)
+    if isinstance(value, dict):
+        return {k: expand_env(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [expand_env(v) for v in value]
+    return value
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Config file not found: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        raw = yaml.safe_load(f) or {}
+    if not isinstance(raw, dict):
+        raise ValueError(f"Config root must be a mapping: {path}")
+    config = expand_env(raw)
+
+    oms = config.get("oms")
+    if not isinstance(oms, dict):
+        raise ValueError("Config is missing the 'oms' section")
+    for key in ("base_url", "api_key"):
+        if not oms.get(key):
+            raise ValueError(f"Config key 'oms.{key}' is required (check the referenced env var)")
+    return config
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .config import load_config
+from .oms_fetch import (
+    STOCK_SCHEMA,
+    FetchError,
+    FetchSettings,
+    ParquetSink,
+    fetch_snapshot,
+    read_sku_file,
+)
+from .snapshot_cache import SnapshotCache, digest_values
+
+
+EXIT_CONFIG = 1
+EXIT_FETCH = 2
+
+SNAPSHOT_KEY_METADATA = b"stock_reconcile.cache_key"
+
+
+def oms_cache_query(settings: FetchSettings, skus: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """Everything besides date and schema that changes what the OMS snapshot contains."""
+    return {
+        "base_url": settings.base_url,
+        "stock_path": settings.stock_path,
+        "skus": digest_values(skus),
+    }
+
+
+def snapshot_key(path: str) -> Optional[str]:
+    """Cache key recorded in an output snapshot's metadata, or None if absent/unreadable."""
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    value = metadata.get(SNAPSHOT_KEY_METADATA)
+    return value.decode("utf-8") if value else None
+
+
+def write_snapshot(table: pa.Table, path: str, key: str) -> None:
+    """Write the snapshot to `path`, tagged with its cache key so identical reruns can skip it."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOT_KEY_METADATA] = key.encode("utf-8")
+    tmp_path = f"{path}.partial"
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconcile stock quantities between OMS and DWH")
+    parser.add_argument("--config", default="config.yaml", help="Path to config YAML (default: config.yaml)")
+    parser.add_argument("--date", help="Snapshot date YYYY-MM-DD (default: today in options.timezone)")
+    parser.add_argument("--output", help="Output directory (default: options.output_dir or ./out)")
+    parser.add_argument("--sku-file", help="Limit the snapshot to SKUs listed in this file (one per line)")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-fetch source snapshots even if they are cached for this date",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the local snapshot cache entirely")
+
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+        options = config.get("options") or {}
+        settings = FetchSettings.from_config(config["oms"])
+        tz = ZoneInfo(str(options.get("timezone") or "UTC"))
+        date = args.date or datetime.now(tz).strftime("%Y-%m-%d")
+        datetime.strptime(date, "%Y-%m-%d")
+        skus = read_sku_file(args.sku_file) if args.sku_file else None
+        if skus is not None and not skus:
+            raise ValueError(f"SKU file contains no SKUs: {args.sku_file}")
+        output_dir = args.output or options.get("output_dir") or "./out"
+        cache_config = config.get("cache") or {}
+        cache = None
+        if not args.no_cache and cache_config.get("enabled", True):
+            cache = SnapshotCache.from_config(cache_config)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_CONFIG
+
+    oms_path = os.path.join(output_dir, f"oms_stock_{date}.parquet")
+    try:
+        if cache is None:
+            stats = fetch_snapshot(settings, date, skus, ParquetSink(oms_path))
+        else:
+            key = cache.make_key("oms", date, STOCK_SCHEMA, oms_cache_query(settings, skus))
+            table = None if args.refresh else cache.get(key)
+            if table is not None:
+                print(f"Using cached OMS snapshot for {date} ({table.num_rows} rows) from {cache.path_for(key)}")
+                stats = None
+            else:
+                stats = fetch_snapshot(settings, date, skus, cache.writer(key, STOCK_SCHEMA))
+                table = cache.get(key)
+                if table is None:
+                    raise FetchError(f"Cached snapshot could not be read back: {cache.path_for(key)}")
+            if stats is not None or snapshot_key(oms_path) != key:
+                write_snapshot(table, oms_path, key)
+    except (FetchError, OSError) as e:
+        print(f"Error: OMS fetch failed: {e}", file=sys.stderr)
+        return EXIT_FETCH
+
+    if stats is not None:
+        print(
+            f"Fetched {stats.rows} OMS stock rows for {date} in {stats.duration_seconds:.1f}s "
+            f"({stats.requests} requests, {stats.retries} retries) -> {oms_path}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+"""
+Async OMS stock snapshot fetcher.
+
+Pulls stock for (sku, location) pairs from the OMS API using a pooled
+keep-alive HTTP client, a token-bucket rate limit and jittered retries, and
+streams the rows into a columnar file in fixed-size row groups so memory use
+stays flat regardless of snapshot size.
+
+Assumed API contract (GET {base_url}{stock_path}):
+  query:    date=YYYY-MM-DD, page=N, page_size=M, sku=A,B,C (optional)
+  response: {"items": [{"sku", "location_id", "on_hand", "reserved", "available"}],
+             "total_pages": T}          # pages 2..T are fetched concurrently
+        or  {"items": [...], "next_page": N | null}   # followed sequentially; N must exceed the current page
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import aiohttp
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+STOCK_SCHEMA = pa.schema(
+    [
+        ("sku", pa.string()),
+        ("location_id", pa.string()),
+        ("on_hand", pa.int64()),
+        ("reserved", pa.int64()),
+        ("available", pa.int64()),
+    ]
+)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """Raised when the OMS API cannot be read, after retries where applicable."""
+
+
+@dataclass
+class FetchSettings:
+    base_url: str
+    api_key: str
+    timeout_seconds: float = 30.0
+    stock_path: str = "/stock"
+    max_connections: int = 32
+    rate_limit_per_second: float = 50.0
+    rate_limit_burst: Optional[int] = None
+    batch_size: int = 500
+    page_size: int = 1000
+    max_retries: int = 5
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 30.0
+    row_group_size: int = 100_000
+
+    @classmethod
+    def from_config(cls, oms: Dict[str, Any]) -> "FetchSettings":
+        settings = cls(base_url=str(oms["base_url"]).rstrip("/"), api_key=str(oms["api_key"]))
+        for name in (
+            "timeout_seconds",
+            "stock_path",
+            "max_connections",
+            "rate_limit_per_second",
+            "rate_limit_burst",
+            "batch_size",
+            "page_size",
+            "max_retries",
+            "backoff_base_seconds",
+            "backoff_max_seconds",
+            "row_group_size",
+        ):
+            if oms.get(name) is not None:
+                current = getattr(settings, name)
+                cast = type(current) if current is not None else int
+                setattr(settings, name, cast(oms[name]))
+        if settings.max_connections < 1 or settings.batch_size < 1 or settings.page_size < 1:
+            raise ValueError("oms.max_connections, oms.batch_size and oms.page_size must be >= 1")
+        if settings.rate_limit_per_second <= 0:
+            raise ValueError("oms.rate_limit_per_second must be > 0")
+        return settings
+
+
+@dataclass
+class FetchStats:
+    rows: int = 0
+    requests: int = 0
+    retries: int = 0
+    duration_seconds: float = 0.0
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        self.rate = rate
+        self.capacity = float(capacity or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ParquetSink:
+    """Writes record batches to a Parquet file; the file only appears once closed cleanly."""
+
+    def __init__(self, path: str, schema: pa.Schema = STOCK_SCHEMA, compression: str = "zstd"):
+        self.path = path
+        self._tmp_path = f"{path}.partial"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._writer = pq.ParquetWriter(self._tmp_path, schema, compression=compression)
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self._writer.write_batch(batch)
+
+    def close(self) -> None:
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def read_sku_file(path: str) -> List[str]:
+    """Read SKUs one per line; blank lines and '#' comments are ignored."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"SKU file not found: {path}")
+    skus: List[str] = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            s = line.strip()
+            if s and not s.startswith("#") and s not in seen:
+                seen.add(s)
+                skus.append(s)
+    return skus
+
+
+def chunked(values: Sequence[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(values), size):
+        yield list(values[start:start + size])
+
+
+def _to_int(value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    return int(float(value))
+
+
+def _retry_after_seconds(headers: Any) -> Optional[float]:
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _page_number(value: Any, field: str, page: int) -> int:
+    """Validate a page count/number from a response; malformed values raise FetchError."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise FetchError(f"OMS API response for page {page} has invalid {field}: {value!r}")
+    try:
+        number = int(value)
+    except ValueError:
+        raise FetchError(f"OMS API response for page {page} has invalid {field}: {value!r}")
+    if number < 0:
+        raise FetchError(f"OMS API response for page {page} has invalid {field}: {value!r}")
+    return number
+
+
+class OmsStockFetcher:
+    """Fetches a stock snapshot from the OMS API into a sink with `write_batch(batch)`."""
+
+    def __init__(self, settings: FetchSettings, session: Optional[aiohttp.ClientSession] = None):
+        self.settings = settings
+        self._session = session
+        self._bucket = TokenBucket(settings.rate_limit_per_second, settings.rate_limit_burst)
+        self.stats = FetchStats()
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.settings.max_connections,
+            keepalive_timeout=30,
+            ttl_dns_cache=300,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.settings.timeout_seconds),
+            headers={
+                "Authorization": f"Bearer {self.settings.api_key}",
+                "Accept": "application/json",
+            },
+        )
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter: spreads retries of concurrent workers instead of synchronising them
+        ceiling = min(self.settings.backoff_max_seconds, self.settings.backoff_base_seconds * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.settings.backoff_max_seconds))
+        return delay
+
+    async def _get_json(self, session: aiohttp.ClientSession, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.settings.base_url}{self.settings.stock_path}"
+        last_error = ""
+        for attempt in range(self.settings.max_retries + 1):
+            retry_after: Optional[float] = None
+            await self._bucket.acquire()
+            self.stats.requests += 1
+            try:
+                async with session.get(url, params=params) as resp:
+                    if resp.status in RETRYABLE_STATUSES:
+                        retry_after = _retry_after_seconds(resp.headers)
+                        last_error = f"HTTP {resp.status}"
+                    elif resp.status >= 400:
+                        body = await resp.text()
+                        raise FetchError(f"OMS API returned HTTP {resp.status} for page {params.get('page')}: {body[:200]}")
+                    else:
+                        body = await resp.read()
+                        try:
+                            payload = json.loads(body)
+                        except ValueError as e:
+                            raise FetchError(f"OMS API returned invalid JSON for page {params.get('page')}: {e}")
+                        if not isinstance(payload, dict):
+                            raise FetchError(f"OMS API response for page {params.get('page')} is not a JSON object")
+                        return payload
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = str(e) or type(e).__name__
+            if attempt < self.settings.max_retries:
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise FetchError(f"OMS API request failed after {self.settings.max_retries + 1} attempts: {last_error}")
+
+    async def _run_job(
+        self,
+        session: aiohttp.ClientSession,
+        job: Dict[str, Any],
+        jobs: "asyncio.Queue[Dict[str, Any]]",
+        results: "asyncio.Queue[Optional[List[Dict[str, Any]]]]",
+    ) -> None:
+        page = job["page"]
+        while page is not None:
+            params = {"date": job["date"], "page": page, "page_size": self.settings.page_size}
+            if job["skus"]:
+                params["sku"] = ",".join(job["skus"])
+            payload = await self._get_json(session, params)
+            items = payload.get("items")
+            if not isinstance(items, list):
+                raise FetchError(f"OMS API response for page {page} has no 'items' list")
+            if items:
+                await results.put(items)
+
+            total_pages = payload.get("total_pages")
+            if total_pages is not None:
+                total_pages = _page_number(total_pages, "total_pages", page)
+                # Page count is known up front: fan the remaining pages out to the pool
+                if page == 1:
+                    for next_page in range(2, total_pages + 1):
+                        jobs.put_nowait({**job, "page": next_page})
+                return
+            next_page = payload.get("next_page")
+            if next_page is not None:
+                next_page = _page_number(next_page, "next_page", page)
+                if next_page <= page:
+                    # A server repeating or rewinding pages would otherwise be followed forever
+                    raise FetchError(f"OMS API response for page {page} has next_page {next_page}, which does not advance")
+            page = next_page
+
+    async def _worker(self, session, jobs, results) -> None:
+        while True:
+            job = await jobs.get()
+            try:
+                await self._run_job(session, job, jobs, results)
+            finally:
+                jobs.task_done()
+
+    async def _writer(self, results, sink) -> None:
+        columns: Dict[str, List[Any]] = {name: [] for name in STOCK_SCHEMA.names}
+
+        async def flush() -> None:
+            if not columns["sku"]:
+                return
+            batch = pa.RecordBatch.from_pydict(columns, schema=STOCK_SCHEMA)
+            for values in columns.values():
+                values.clear()
+            await asyncio.to_thread(sink.write_batch, batch)
+
+        while True:
+            items = await results.get()
+            if items is None:
+                break
+            for item in items:
+                try:
+                    sku = str(item["sku"])
+                    location_id = str(item.get("location_id", item.get("location", "")))
+                    on_hand = _to_int(item.get("on_hand"))
+                    reserved = _to_int(item.get("reserved"))
+                    available = _to_int(item.get("available"))
+                except (KeyError, TypeError, ValueError, AttributeError) as e:
+                    raise FetchError(f"Malformed OMS stock item {str(item)[:200]}: {e!r}")
+                if available is None and on_hand is not None:
+                    available = on_hand - (reserved or 0)
+                columns["sku"].append(sku)
+                columns["location_id"].append(location_id)
+                columns["on_hand"].append(on_hand)
+                columns["reserved"].append(reserved)
+                columns["available"].append(available)
+            self.stats.rows += len(items)
+            if len(columns["sku"]) >= self.settings.row_group_size:
+                await flush()
+        await flush()
+
+    async def fetch(self, date: str, skus: Optional[Sequence[str]], sink: Any) -> FetchStats:
+        """Fetch the snapshot for `date` (optionally limited to `skus`) into `sink`."""
+        started = time.monotonic()
+        jobs: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        # Bounded so a slow writer applies backpressure to the fetchers
+        results: "asyncio.Queue[Optional[List[Dict[str, Any]]]]" = asyncio.Queue(
+            maxsize=self.settings.max_connections * 2
+        )
+        if skus is not None:
+            # An empty list means "no SKUs", not "all SKUs"; callers reject it up front
+            for batch in chunked(skus, self.settings.batch_size):
+                jobs.put_nowait({"date": date, "skus": batch, "page": 1})
+        else:
+            jobs.put_nowait({"date": date, "skus": None, "page": 1})
+
+        session = self._session or self._new_session()
+        workers = [
+            asyncio.create_task(self._worker(session, jobs, results))
+            for _ in range(self.settings.max_connections)
+        ]
+        writer = asyncio.create_task(self._writer(results, sink))
+        drained = asyncio.create_task(jobs.join())
+        try:
+            done, _ = await asyncio.wait({drained, writer, *workers}, return_when=asyncio.FIRST_COMPLETED)
+            # Workers and the writer only finish before the queue drains when they fail;
+            # a failing last job marks itself done, so check them even if `drained` is set
+            for task in done:
+                if task is not drained and task.exception() is not None:
+                    raise task.exception()
+            if drained not in done:
+                raise FetchError("OMS fetch stopped unexpectedly")
+            await results.put(None)
+            await writer
+        finally:
+            for task in (drained, writer, *workers):
+                task.cancel()
+            await asyncio.gather(drained, writer, *workers, return_exceptions=True)
+            if self._session is None:
+                await session.close()
+        self.stats.duration_seconds = time.monotonic() - started
+        return self.stats
+
+
+def fetch_snapshot(settings: FetchSettings, date: str, skus: Optional[Sequence[str]], sink: Any) -> FetchStats:
+    """Run the fetcher to completion; closes the sink on success and aborts it on failure."""
+    try:
+        stats = asyncio.run(OmsStockFetcher(settings).fetch(date, skus, sink))
+    except BaseException:
+        sink.abort()
+        raise
+    sink.close()
+    return stats
@@ -0,0 +1,172 @@
+"""
+Local content-addressed cache for source snapshots.
+
+Entries are Arrow IPC files named after a digest of (source, date, schema,
+query), so a rerun for the same inputs finds the snapshot without contacting
+the source. Reads go through a memory map: with `compression: none` (the
+default) the returned table references the mapped pages directly (no copy);
+lz4/zstd trade a decompression copy on every read for smaller files. The
+directory is kept under `max_size_mb` by evicting least recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+
+
+CACHE_FORMAT_VERSION = 1
+ENTRY_SUFFIX = ".arrow"
+PARTIAL_SUFFIX = ".partial"
+# Partial files older than this are left over from crashed runs, not in-progress fetches
+STALE_PARTIAL_SECONDS = 6 * 60 * 60
+COMPRESSIONS = ("none", "lz4", "zstd")
+
+
+def digest_values(values: Optional[Sequence[str]]) -> Optional[str]:
+    """Order-independent digest of a value list (e.g. a SKU subset), None for "all"."""
+    if values is None:
+        return None
+    h = hashlib.sha256()
+    for v in sorted(set(values)):
+        h.update(v.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class IpcSink:
+    """Writes record batches to a cache entry; the entry only becomes visible once closed cleanly."""
+
+    def __init__(self, cache: "SnapshotCache", path: str, schema: pa.Schema):
+        self._cache = cache
+        self.path = path
+        self._tmp_path = path + PARTIAL_SUFFIX
+        compression = None if cache.compression == "none" else cache.compression
+        self._sink = pa.OSFile(self._tmp_path, "wb")
+        self._writer = pa.ipc.new_file(
+            self._sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression)
+        )
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self._writer.write_batch(batch)
+
+    def close(self) -> None:
+        self._writer.close()
+        self._sink.close()
+        os.replace(self._tmp_path, self.path)
+        self._cache.evict(keep=self.path)
+
+    def abort(self) -> None:
+        self._writer.close()
+        self._sink.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class SnapshotCache:
+    def __init__(self, directory: str, max_size_mb: float = 2048, compression: str = "none"):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid cache compression: {compression}. Must be one of: {list(COMPRESSIONS)}")
+        self.directory = directory
+        self.max_bytes = int(float(max_size_mb) * 1024 * 1024)
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cache: Dict[str, Any]) -> "SnapshotCache":
+        return cls(
+            directory=str(cache.get("dir") or "./.cache/snapshots"),
+            max_size_mb=cache.get("max_size_mb", 2048),
+            compression=str(cache.get("compression") or "none"),
+        )
+
+    @staticmethod
+    def make_key(source: str, date: str, schema: pa.Schema, query: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {
+                "version": CACHE_FORMAT_VERSION,
+                "source": source,
+                "date": date,
+                "schema": schema.to_string(show_schema_metadata=False),
+                "query": query,
+            },
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+        return f"{source}-{date}-{digest}"
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> Optional[pa.Table]:
+        """Return the cached table for `key` (memory-mapped), or None on a miss.
+
+        A truncated or corrupt entry is removed and reported as a miss.
+        """
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+        except (pa.ArrowInvalid, OSError):
+            self.invalidate(key)
+            return None
+        # Bump mtime so eviction treats the entry as recently used
+        os.utime(path)
+        return table
+
+    def writer(self, key: str, schema: pa.Schema) -> IpcSink:
+        return IpcSink(self, self.path_for(key), schema)
+
+    def invalidate(self, key: str) -> None:
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def entries(self) -> List[str]:
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(ENTRY_SUFFIX)
+        ]
+
+    def partials(self) -> List[str]:
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(ENTRY_SUFFIX + PARTIAL_SUFFIX)
+        ]
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """Remove stale partial files, then least recently used entries until the cache fits in max_size_mb.
+
+        Partial files of fetches still in progress count towards the size but are never removed.
+        """
+        removed: List[str] = []
+        in_progress = 0
+        now = time.time()
+        for path in self.partials():
+            try:
+                if now - os.path.getmtime(path) > STALE_PARTIAL_SECONDS:
+                    os.remove(path)
+                    removed.append(path)
+                else:
+                    in_progress += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+
+        entries = sorted(self.entries(), key=os.path.getmtime)
+        total = in_progress + sum(os.path.getsize(p) for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= os.path.getsize(path)
+            os.remove(path)
+            removed.append(path)
+        return removed
@@ -0,0 +1,92 @@
+"""Local stub of the OMS stock API, run on a background thread for tests and manual runs."""
+
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+class StubOms:
+    """
+    Serves GET /stock following the contract documented in src/oms_fetch.py.
+
+    - rows: rows of the full snapshot; with ?sku=..., each SKU gets one row per location
+    - mode: "total_pages" or "next_page" pagination
+    - failures: statuses returned (in order) before any successful response
+    - body: raw body returned instead of a JSON page (malformed-response tests)
+    - page_override: fields merged into every JSON page, e.g. {"next_page": 1}
+    """
+
+    def __init__(
+        self,
+        rows: int = 0,
+        mode: str = "total_pages",
+        failures: Optional[List[int]] = None,
+        body: Optional[bytes] = None,
+        items_override: Optional[List[Any]] = None,
+        page_override: Optional[Dict[str, Any]] = None,
+    ):
+        self.rows = rows
+        self.mode = mode
+        self.failures = list(failures or [])
+        self.body = body
+        self.items_override = items_override
+        self.page_override = page_override or {}
+        self.requests: List[Dict[str, str]] = []
+        self.url = ""
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.query))
+        if self.failures:
+            status = self.failures.pop(0)
+            return web.Response(status=status, headers={"Retry-After": "0"} if status == 429 else None)
+        if self.body is not None:
+            return web.Response(body=self.body, content_type="application/json")
+
+        page = int(request.query["page"])
+        page_size = int(request.query["page_size"])
+        if "sku" in request.query:
+            keys = [(sku, loc) for sku in request.query["sku"].split(",") for loc in ("L1", "L2")]
+        else:
+            keys = [(f"SKU{i:07d}", "L1") for i in range(self.rows)]
+        total_pages = max(1, -(-len(keys) // page_size))
+        items = self.items_override if self.items_override is not None else [
+            {"sku": sku, "location_id": loc, "on_hand": 5, "reserved": 1}
+            for sku, loc in keys[(page - 1) * page_size:page * page_size]
+        ]
+        if self.mode == "total_pages":
+            payload = {"items": items, "total_pages": total_pages}
+        else:
+            payload = {"items": items, "next_page": page + 1 if page < total_pages else None}
+        return web.json_response({**payload, **self.page_override})
+
+    def __enter__(self) -> "StubOms":
+        started = threading.Event()
+
+        def serve() -> None:
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_get("/stock", self._handle)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            self._loop.run_until_complete(site.start())
+            port = self._runner.addresses[0][1]
+            self.url = f"http://127.0.0.1:{port}"
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait(5)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
@@ -0,0 +1,163 @@
+import pyarrow.parquet as pq
+import pytest
+
+from src.main import main
+from src.oms_fetch import FetchError, FetchSettings, ParquetSink, fetch_snapshot
+
+from .stub_oms import StubOms
+
+
+class ListSink:
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+        self.aborted = False
+
+    def write_batch(self, batch):
+        self.batches.append(batch)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+    @property
+    def rows(self):
+        return sum(b.num_rows for b in self.batches)
+
+
+def settings_for(stub, **overrides):
+    values = dict(
+        base_url=stub.url,
+        api_key="k",
+        rate_limit_per_second=1000,
+        page_size=100,
+        batch_size=2,
+        max_connections=4,
+        backoff_base_seconds=0.01,
+        backoff_max_seconds=0.05,
+    )
+    values.update(overrides)
+    return FetchSettings(**values)
+
+
+def test_total_pages_fans_out_remaining_pages():
+    with StubOms(rows=250) as stub:
+        sink = ListSink()
+        stats = fetch_snapshot(settings_for(stub), "2025-08-15", None, sink)
+    assert stats.rows == 250 and sink.rows == 250 and sink.closed
+    assert sorted(int(q["page"]) for q in stub.requests) == [1, 2, 3]
+    assert all(q["date"] == "2025-08-15" for q in stub.requests)
+
+
+def test_next_page_is_followed_and_available_is_derived(tmp_path):
+    path = tmp_path / "oms.parquet"
+    with StubOms(rows=250, mode="next_page") as stub:
+        stats = fetch_snapshot(settings_for(stub), "2025-08-15", None, ParquetSink(str(path)))
+    table = pq.read_table(path)
+    assert stats.rows == 250 and table.num_rows == 250
+    assert set(table.column("available").to_pylist()) == {4}
+    assert len(stub.requests) == 3
+
+
+def test_skus_are_batched():
+    with StubOms() as stub:
+        sink = ListSink()
+        fetch_snapshot(settings_for(stub), "2025-08-15", ["A", "B", "C", "D", "E"], sink)
+    assert sorted(q["sku"] for q in stub.requests) == ["A,B", "C,D", "E"]
+    assert sink.rows == 10
+
+
+def test_retries_429_and_5xx():
+    with StubOms(rows=10, failures=[429, 503, 500]) as stub:
+        sink = ListSink()
+        stats = fetch_snapshot(settings_for(stub, max_connections=1), "2025-08-15", None, sink)
+    assert stats.retries == 3 and sink.rows == 10
+
+
+def test_gives_up_after_max_retries():
+    with StubOms(rows=10, failures=[503] * 10) as stub:
+        sink = ListSink()
+        with pytest.raises(FetchError, match="after 3 attempts"):
+            fetch_snapshot(settings_for(stub, max_retries=2), "2025-08-15", None, sink)
+    assert sink.aborted and not sink.closed
+
+
+def test_client_error_is_not_retried():
+    with StubOms(rows=10, failures=[404]) as stub:
+        with pytest.raises(FetchError, match="HTTP 404"):
+            fetch_snapshot(settings_for(stub), "2025-08-15", None, ListSink())
+    assert len(stub.requests) == 1
+
+
+@pytest.mark.parametrize(
+    "stub_kwargs",
+    [
+        {"body": b"<html>oops</html>"},
+        {"items_override": [{"location_id": "L1", "on_hand": 1}]},
+        {"items_override": [{"sku": "A", "on_hand": "lots"}]},
+        {"page_override": {"total_pages": "many"}},
+        {"page_override": {"total_pages": -1}},
+        {"mode": "next_page", "page_override": {"next_page": "later"}},
+        {"mode": "next_page", "page_override": {"next_page": 1}},
+    ],
+)
+def test_malformed_responses_raise_fetch_error(stub_kwargs):
+    with StubOms(rows=1, **stub_kwargs) as stub:
+        with pytest.raises(FetchError):
+            fetch_snapshot(settings_for(stub), "2025-08-15", None, ListSink())
+
+
+def test_next_page_that_does_not_advance_is_rejected():
+    with StubOms(rows=1, mode="next_page", page_override={"next_page": 1}) as stub:
+        with pytest.raises(FetchError, match="does not advance"):
+            fetch_snapshot(settings_for(stub), "2025-08-15", None, ListSink())
+    assert len(stub.requests) == 1
+
+
+def write_config(tmp_path, url):
+    config = tmp_path / "config.yaml"
+    config.write_text(
+        "oms:\n"
+        f"  base_url: {url}\n"
+        "  api_key: k\n"
+        "  rate_limit_per_second: 1000\n"
+        "  backoff_base_seconds: 0.01\n"
+        "  max_retries: 1\n"
+        "cache:\n"
+        f"  dir: {tmp_path / 'cache'}\n"
+    )
+    return str(config)
+
+
+def test_cli_writes_snapshot(tmp_path):
+    with StubOms(rows=30) as stub:
+        config = write_config(tmp_path, stub.url)
+        rc = main(["--config", config, "--date", "2025-08-15", "--output", str(tmp_path / "out"), "--no-cache"])
+    assert rc == 0
+    assert pq.read_table(tmp_path / "out" / "oms_stock_2025-08-15.parquet").num_rows == 30
+
+
+def test_cli_exits_2_on_malformed_pagination(tmp_path):
+    with StubOms(rows=30, page_override={"total_pages": "many"}) as stub:
+        config = write_config(tmp_path, stub.url)
+        rc = main(["--config", config, "--date", "2025-08-15", "--output", str(tmp_path / "out"), "--no-cache"])
+    assert rc == 2
+
+
+def test_cli_rejects_empty_sku_file(tmp_path):
+    sku_file = tmp_path / "skus.txt"
+    sku_file.write_text("# nothing here\n\n")
+    with StubOms(rows=30) as stub:
+        config = write_config(tmp_path, stub.url)
+        rc = main(["--config", config, "--date", "2025-08-15", "--sku-file", str(sku_file)])
+    assert rc == 1
+    assert stub.requests == []
+
+
+def test_cli_fetch_failure_exits_2(tmp_path):
+    with StubOms(body=b"not json") as stub:
+        config = write_config(tmp_path, stub.url)
+        rc = main(["--config", config, "--date", "2025-08-15", "--output", str(tmp_path / "out")])
+    assert rc == 2
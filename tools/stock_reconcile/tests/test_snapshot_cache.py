@@ -0,0 +1,135 @@
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.main import main
+from src.oms_fetch import STOCK_SCHEMA
+from src.snapshot_cache import STALE_PARTIAL_SECONDS, SnapshotCache, digest_values
+
+from .stub_oms import StubOms
+from .test_oms_fetch import write_config
+
+
+DATE = "2025-08-15"
+
+
+def make_table(rows):
+    return pa.table(
+        {
+            "sku": [f"SKU{i}" for i in range(rows)],
+            "location_id": ["L1"] * rows,
+            "on_hand": [5] * rows,
+            "reserved": [1] * rows,
+            "available": [4] * rows,
+        },
+        schema=STOCK_SCHEMA,
+    )
+
+
+def put(cache, key, table):
+    sink = cache.writer(key, table.schema)
+    for batch in table.to_batches():
+        sink.write_batch(batch)
+    sink.close()
+
+
+def run(tmp_path, stub, *extra):
+    config = write_config(tmp_path, stub.url)
+    return main(["--config", config, "--date", DATE, "--output", str(tmp_path / "out"), *extra])
+
+
+def test_digest_distinguishes_empty_from_all():
+    assert digest_values(None) is None
+    assert digest_values([]) is not None
+    assert digest_values(["b", "a"]) == digest_values(["a", "b", "a"])
+
+
+def test_round_trip_and_miss(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get("oms-x") is None
+    put(cache, "oms-x", make_table(10))
+    assert cache.get("oms-x").equals(make_table(10))
+
+
+def test_corrupt_entry_is_a_miss_and_removed(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    put(cache, "oms-x", make_table(10))
+    path = cache.path_for("oms-x")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert cache.get("oms-x") is None
+    assert not os.path.exists(path)
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = SnapshotCache(str(tmp_path), max_size_mb=1)
+    for i, key in enumerate(["a", "b", "c"]):
+        put(cache, key, make_table(10))
+        os.utime(cache.path_for(key), (1000 + i, 1000 + i))
+    entry_size = os.path.getsize(cache.path_for("a"))
+    cache.max_bytes = entry_size * 2
+    cache.get("a")  # touching "a" makes "b" the oldest
+    removed = cache.evict()
+    assert removed == [cache.path_for("b")]
+    assert sorted(os.path.basename(p) for p in cache.entries()) == ["a.arrow", "c.arrow"]
+
+
+def test_evict_cleans_stale_partials_and_counts_fresh_ones(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    put(cache, "a", make_table(10))
+    stale = cache.path_for("crashed") + ".partial"
+    fresh = cache.path_for("running") + ".partial"
+    for path in (stale, fresh):
+        with open(path, "wb") as f:
+            f.write(b"x" * 1024)
+    old = time.time() - STALE_PARTIAL_SECONDS - 60
+    os.utime(stale, (old, old))
+    cache.max_bytes = os.path.getsize(cache.path_for("a")) + 512
+    removed = cache.evict()
+    assert stale in removed and cache.path_for("a") in removed
+    assert os.path.exists(fresh)
+
+
+def test_cli_hit_skips_fetch_and_output_rewrite(tmp_path):
+    oms_path = tmp_path / "out" / f"oms_stock_{DATE}.parquet"
+    with StubOms(rows=30) as stub:
+        assert run(tmp_path, stub) == 0
+        fetched = len(stub.requests)
+        written = os.stat(oms_path).st_mtime_ns
+        assert run(tmp_path, stub) == 0
+    assert fetched > 0 and len(stub.requests) == fetched
+    assert os.stat(oms_path).st_mtime_ns == written
+    assert pq.read_table(oms_path).num_rows == 30
+
+
+def test_cli_hit_restores_missing_output(tmp_path):
+    oms_path = tmp_path / "out" / f"oms_stock_{DATE}.parquet"
+    with StubOms(rows=30) as stub:
+        assert run(tmp_path, stub) == 0
+        fetched = len(stub.requests)
+        os.remove(oms_path)
+        assert run(tmp_path, stub) == 0
+    assert len(stub.requests) == fetched
+    assert pq.read_table(oms_path).num_rows == 30
+
+
+def test_cli_refresh_refetches(tmp_path):
+    with StubOms(rows=30) as stub:
+        assert run(tmp_path, stub) == 0
+        fetched = len(stub.requests)
+        assert run(tmp_path, stub, "--refresh") == 0
+    assert len(stub.requests) == 2 * fetched
+
+
+def test_cli_corrupt_entry_is_refetched(tmp_path):
+    with StubOms(rows=30) as stub:
+        assert run(tmp_path, stub) == 0
+        fetched = len(stub.requests)
+        [entry] = SnapshotCache(str(tmp_path / "cache")).entries()
+        with open(entry, "wb") as f:
+            f.write(b"not arrow")
+        assert run(tmp_path, stub) == 0
+    assert len(stub.requests) == 2 * fetched
+    assert pq.read_table(tmp_path / "out" / f"oms_stock_{DATE}.parquet").num_rows == 30